@@ -0,0 +1,23 @@
+"""Headless core of the GEISEL ANKI Flashcard Generator
+
+PDF extraction, card generation with Claude and .apkg export, importable
+without Streamlit. The web app (streamlit_app.py) and the command line
+(python -m anki_generator) are both thin layers over this package.
+"""
+from .api import get_client_pool, get_rate_limiter, get_usage_stats
+from .batch import (
+    BATCH_API_CONCURRENCY, BATCH_EXTRACT_CONCURRENCY, batch_results_zip, resolve_batch_sources, run_batch_generation,
+)
+from .cards import NearDuplicateIndex, dedupe_cards, parse_cards_response, salvage_cards
+from .compaction import compact_extraction, compact_pages
+from .export import export_apkg_file, generate_apkg_file, plan_export
+from .generation import (
+    GENERATION_MAX_CONCURRENCY, generate_cards_chunked, generate_cards_with_claude, stream_cards_with_claude,
+)
+from .media import attach_slide_images, extract_slide_media
+from .pdf import PDF_PARALLEL_MIN_PAGES, PdfExtractionJob, extract_pdf_text, get_pdf_text_cache
+from .prompts import PROMPT_CACHE_MIN_TOKENS, system_prompt_cacheable
+from .review import REVIEW_FACETS, ReviewIndex
+from .settings import configure, get_setting
+from .store import CardRecord, CardStore
+from .tokens import LECTURE_TOKEN_BUDGET, estimate_tokens, get_token_telemetry, lecture_excerpt
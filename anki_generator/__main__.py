@@ -0,0 +1,6 @@
+"""python -m anki_generator"""
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,372 @@
+"""Anthropic API plumbing: usage accounting, response cache, rate limiting, client pool and retries"""
+import contextlib
+import json
+import os
+import time
+
+from .settings import PROJECT_DIR, get_setting, shared
+
+def usage_to_dict(usage):
+    """Token counts from an Anthropic message's usage, including prompt cache reads and writes"""
+    return {
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+    }
+
+class UsageStats:
+    """Thread-safe running totals of API token usage across all sessions"""
+
+    def __init__(self):
+        import threading
+
+        self.totals = {
+            "requests": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        }
+        self._lock = threading.Lock()
+
+    def record(self, usage):
+        with self._lock:
+            self.totals["requests"] += 1
+            for key, value in usage.items():
+                self.totals[key] = self.totals.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.totals)
+
+@shared
+def get_usage_stats():
+    """Process-wide token usage totals shared by every session"""
+    return UsageStats()
+
+# Bump whenever the prompt text or its structure changes so cached responses are not reused
+PROMPT_TEMPLATE_VERSION = 1
+
+def response_cache_key(pdf_text, model, num_cards, lecture_title="", custom_guidance="", token_budget=None):
+    """Hash of everything that determines a generation response
+
+    Keyed on the full lecture text and the token budget rather than the
+    excerpt actually sent: where the excerpt is cut depends on token
+    telemetry that moves with every call.
+    """
+    import hashlib
+
+    payload = json.dumps(
+        [PROMPT_TEMPLATE_VERSION, model, num_cards, lecture_title, custom_guidance, token_budget, pdf_text],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """SQLite-backed cache of parsed generation responses with TTL and size-based eviction"""
+
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_entries=1000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key text primary key,
+                    cards text not null,
+                    usage text not null,
+                    created real not null,
+                    last_used real not null
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Connection for one call, committed on success and always closed"""
+        import sqlite3
+
+        # One short-lived connection per call keeps the cache safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Return (cards, usage) for a fresh entry, or None"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT cards, usage FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, key, cards, usage):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, cards, usage, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(cards), json.dumps(usage), now, now)
+            )
+            conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+            # Least recently used entries go first once the cache is over size
+            conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+@shared
+def get_response_cache():
+    """Process-wide response cache, or None if the cache file cannot be created"""
+    default_path = os.path.join(PROJECT_DIR, ".cache", "responses.sqlite")
+    try:
+        return ResponseCache(
+            get_setting("RESPONSE_CACHE_PATH", default_path),
+            ttl_seconds=float(get_setting("RESPONSE_CACHE_TTL_DAYS", 7)) * 24 * 3600,
+            max_entries=int(get_setting("RESPONSE_CACHE_MAX_ENTRIES", 1000)),
+        )
+    except Exception:
+        return None
+
+# Attempts per API request (the first call plus retries of transient failures)
+API_MAX_ATTEMPTS = 5
+API_RETRY_BASE_DELAY = 1.0
+API_RETRY_MAX_DELAY = 30.0
+
+class TokenBucketRateLimiter:
+    """Process-wide requests-per-minute and tokens-per-minute limiter that queues callers
+
+    Callers are served in arrival order: each blocks in acquire() until both
+    buckets hold enough capacity for its request instead of failing, so a
+    class sharing one API key drains smoothly rather than retrying in bursts.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        import threading
+
+        self.request_rate = requests_per_minute / 60.0
+        self.token_rate = tokens_per_minute / 60.0
+        self.request_capacity = float(max(1, requests_per_minute))
+        self.token_capacity = float(max(1, tokens_per_minute))
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._updated = time.monotonic()
+        self._next_ticket = 0
+        self._serving = 0
+        self._queued_tokens = 0
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.request_capacity, self._requests + elapsed * self.request_rate)
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_rate)
+
+    def _wait_for(self, requests, tokens):
+        # Seconds until both buckets can cover the given amounts
+        request_wait = max(0.0, requests - self._requests) / self.request_rate if self.request_rate else 0.0
+        token_wait = max(0.0, tokens - self._tokens) / self.token_rate if self.token_rate else 0.0
+        return max(request_wait, token_wait)
+
+    def acquire(self, tokens):
+        """Block until this request may start; returns the seconds spent waiting"""
+        tokens = min(float(tokens), self.token_capacity)
+        started = time.monotonic()
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._queued_tokens += tokens
+            try:
+                while True:
+                    if ticket == self._serving:
+                        self._refill()
+                        wait = self._wait_for(1, tokens)
+                        if wait <= 0:
+                            self._requests -= 1
+                            self._tokens -= tokens
+                            self._serving += 1
+                            self._condition.notify_all()
+                            return time.monotonic() - started
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+            finally:
+                self._queued_tokens -= tokens
+
+    def status(self):
+        """Current queue depth and the estimated wait for a request arriving now"""
+        with self._condition:
+            self._refill()
+            queue_depth = self._next_ticket - self._serving
+            return {
+                "queue_depth": queue_depth,
+                "wait_seconds": self._wait_for(queue_depth + 1, self._queued_tokens),
+            }
+
+@shared
+def get_rate_limiter():
+    """Rate limiter shared by every session using this server's API keys"""
+    return TokenBucketRateLimiter(
+        requests_per_minute=int(get_setting("ANTHROPIC_REQUESTS_PER_MINUTE", 50)),
+        tokens_per_minute=int(get_setting("ANTHROPIC_TOKENS_PER_MINUTE", 30000)),
+    )
+
+class AnthropicClientPool:
+    """Process-wide Anthropic clients, one per API key, reused across requests and sessions
+
+    Clients are keyed by a hash of the API key so the key itself is not held
+    as a dict key. Each client keeps its own pool of keep-alive connections
+    (and TLS sessions) warm; clients idle for longer than idle_seconds are
+    closed and dropped.
+    """
+
+    def __init__(self, max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0,
+                 connect_timeout=10.0, read_timeout=600.0, idle_seconds=1800.0):
+        import threading
+
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_seconds = idle_seconds
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _create(self, api_key):
+        import anthropic
+
+        # Built only from what the SDK exports: it has moved from httpx to httpx2, so httpx may not be installed
+        timeout = anthropic.Timeout(self.read_timeout, connect=self.connect_timeout)
+        client_options = {"timeout": timeout}
+        limits = self._connection_limits()
+        if limits is not None and hasattr(anthropic, "DefaultHttpxClient"):
+            client_options = {"http_client": anthropic.DefaultHttpxClient(limits=limits, timeout=timeout)}
+        # Retries are handled by call_with_retries so they go through the shared rate limiter
+        return anthropic.Anthropic(api_key=api_key, max_retries=0, **client_options)
+
+    def _connection_limits(self):
+        """Connection limits in the SDK's own HTTP library, or None to keep the SDK's defaults
+
+        The SDK does not export its Limits class, so it is taken from the
+        private DEFAULT_CONNECTION_LIMITS constant (an httpx.Limits in 0.x
+        releases, httpx2.Limits in 1.x; checked against anthropic 1.14.0).
+        If a release moves or reshapes it, clients are still created, just
+        with the SDK's default pool limits.
+        """
+        try:
+            from anthropic._constants import DEFAULT_CONNECTION_LIMITS
+
+            return type(DEFAULT_CONNECTION_LIMITS)(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            )
+        except (ImportError, TypeError):
+            return None
+
+    def get(self, api_key):
+        """Client for this API key, created on first use"""
+        import hashlib
+
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                k for k, (_, last_used) in self._clients.items()
+                if k != key_hash and now - last_used > self.idle_seconds
+            ]
+            evicted = [self._clients.pop(k)[0] for k in idle]
+            entry = self._clients.get(key_hash)
+            client = entry[0] if entry else self._create(api_key)
+            self._clients[key_hash] = (client, now)
+        for stale in evicted:
+            try:
+                stale.close()
+            except Exception:
+                pass
+        return client
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._clients)}
+
+@shared
+def get_client_pool():
+    """Anthropic client pool shared by every session on this server"""
+    return AnthropicClientPool(
+        max_connections=int(get_setting("ANTHROPIC_MAX_CONNECTIONS", 20)),
+        max_keepalive_connections=int(get_setting("ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS", 10)),
+        connect_timeout=float(get_setting("ANTHROPIC_CONNECT_TIMEOUT", 10)),
+        read_timeout=float(get_setting("ANTHROPIC_READ_TIMEOUT", 600)),
+        idle_seconds=float(get_setting("ANTHROPIC_CLIENT_IDLE_MINUTES", 30)) * 60,
+    )
+
+def is_retryable_error(error):
+    """True for rate limits, overloaded and 5xx responses, and connection failures"""
+    import anthropic
+
+    if isinstance(error, (anthropic.RateLimitError, anthropic.InternalServerError, anthropic.APIConnectionError)):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code in (408, 409, 429, 500, 502, 503, 504, 529)
+
+def retry_delay(attempt, error=None):
+    """Full-jitter exponential backoff, never shorter than the server's retry-after"""
+    import random
+
+    delay = random.uniform(0, min(API_RETRY_MAX_DELAY, API_RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(delay, min(float(retry_after), API_RETRY_MAX_DELAY)) if retry_after else delay
+    except ValueError:
+        return delay
+
+def call_with_retries(request, estimated_tokens, report=None):
+    """Run an API request through the shared rate limiter, retrying transient failures
+
+    `request` is a zero-argument callable. Each attempt waits its turn in
+    the limiter; retryable errors back off with jitter, others are raised.
+    """
+    for attempt in range(API_MAX_ATTEMPTS):
+        waited = get_rate_limiter().acquire(estimated_tokens)
+        if report is not None:
+            report["queue_seconds"] = report.get("queue_seconds", 0.0) + waited
+        try:
+            return request()
+        except Exception as e:
+            if not is_retryable_error(e) or attempt + 1 >= API_MAX_ATTEMPTS:
+                raise
+            if report is not None:
+                report["retries"] = attempt + 1
+            time.sleep(retry_delay(attempt, e))
+
+def api_error_message(error):
+    """User-facing message for an exception raised while calling the Claude API"""
+    if isinstance(error, ImportError):
+        if (error.name or "").split(".")[0] == "anthropic":
+            return "Please install the Anthropic library: pip install anthropic"
+        return f"A required library could not be imported: {error}"
+
+    import anthropic
+
+    if isinstance(error, anthropic.AuthenticationError):
+        return "Authentication failed. Please check your API key is correct and has been copied fully."
+    if isinstance(error, anthropic.PermissionDeniedError):
+        return "Permission denied. Make sure you have credits in your Anthropic account."
+    if isinstance(error, anthropic.RateLimitError):
+        return "Rate limit exceeded. Please wait a moment and try again."
+    error_msg = str(error).lower()
+    if "invalid x-api-key" in error_msg or "authentication" in error_msg:
+        return "Invalid API key. Please double-check:\n1. Key starts with 'sk-ant-'\n2. No extra spaces\n3. Full key copied\n4. Key is active in console.anthropic.com"
+    return "Error calling Claude API. Please check your API key and try again."
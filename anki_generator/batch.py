@@ -0,0 +1,136 @@
+"""Batch generation of one card set per lecture PDF"""
+import io
+import json
+import os
+import time
+
+from .compaction import compact_extraction
+from .generation import generate_cards_chunked, generate_cards_with_claude
+from .pdf import extract_pdf_text
+
+# Batch generation defaults: separate bounds for PDF extraction and API calls
+BATCH_EXTRACT_CONCURRENCY = 2
+BATCH_API_CONCURRENCY = 4
+
+def resolve_batch_sources(sources):
+    """Normalize a directory, a list of PDF paths and/or (name, bytes) pairs into (name, loader) pairs"""
+    from pathlib import Path
+
+    if isinstance(sources, (str, os.PathLike)):
+        sources = sorted(Path(sources).glob("*.pdf"))
+
+    resolved = []
+    for source in sources:
+        if isinstance(source, tuple):
+            name, data = source
+            resolved.append((name, lambda data=data: data))
+        else:
+            path = Path(source)
+            resolved.append((path.name, path.read_bytes))
+    return resolved
+
+async def run_batch_generation(sources, num_cards, api_key, model, custom_guidance="", output_dir=None,
+                               extract_concurrency=BATCH_EXTRACT_CONCURRENCY,
+                               api_concurrency=BATCH_API_CONCURRENCY,
+                               chunked=False, on_progress=None):
+    """Generate one card set per lecture PDF with bounded extraction and API concurrency
+
+    `sources` is a directory of PDFs or a list of paths / (name, bytes)
+    pairs. Extraction and API calls run in separate bounded pools, API
+    calls queue in the shared rate limiter, and each finished lecture is
+    written to output_dir/<name>.json when output_dir is given. Returns
+    (results, summary): per-lecture latency records and overall throughput.
+    on_progress(result) is called on the event loop as each lecture finishes.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from pathlib import Path
+
+    lectures = resolve_batch_sources(sources)
+    if output_dir is not None:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    loop = asyncio.get_running_loop()
+    extract_gate = asyncio.Semaphore(extract_concurrency)
+    api_gate = asyncio.Semaphore(api_concurrency)
+    batch_started = time.monotonic()
+
+    async def process(name, load):
+        result = {"lecture": name, "pages": 0, "cards": [], "error": None,
+                  "extract_seconds": 0.0, "generate_seconds": 0.0}
+        started = time.monotonic()
+        try:
+            async with extract_gate:
+                pdf_bytes = await loop.run_in_executor(extract_executor, load)
+                extracted = await loop.run_in_executor(extract_executor, extract_pdf_text, io.BytesIO(pdf_bytes))
+            result["extract_seconds"] = time.monotonic() - started
+            if not extracted:
+                result["error"] = "Could not extract text from PDF"
+                return result
+            extracted = compact_extraction(extracted)
+            result["pages"] = extracted["metadata"]["page_count"]
+            result["tokens_saved"] = extracted["compaction"]["tokens_saved"]
+            title = extracted["metadata"]["title"]
+            lecture_title = title if title != "Unknown" else Path(name).stem
+
+            generate_started = time.monotonic()
+            async with api_gate:
+                if chunked:
+                    cards, error = await loop.run_in_executor(
+                        api_executor, generate_cards_chunked, extracted["pages"], num_cards,
+                        api_key, model, lecture_title, custom_guidance
+                    )
+                else:
+                    cards, error = await loop.run_in_executor(
+                        api_executor, generate_cards_with_claude, extracted["full_text"], num_cards,
+                        api_key, model, lecture_title, custom_guidance
+                    )
+            result["generate_seconds"] = time.monotonic() - generate_started
+            result["cards"] = cards or []
+            result["error"] = error
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            result["total_seconds"] = time.monotonic() - started
+
+        if output_dir is not None and not result["error"]:
+            out_path = Path(output_dir) / (Path(name).stem + ".json")
+            await loop.run_in_executor(
+                extract_executor,
+                lambda: out_path.write_text(json.dumps(result, indent=2), encoding="utf-8")
+            )
+        return result
+
+    async def process_and_report(name, load):
+        result = await process(name, load)
+        if on_progress is not None:
+            on_progress(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=extract_concurrency) as extract_executor, \
+            ThreadPoolExecutor(max_workers=api_concurrency) as api_executor:
+        results = await asyncio.gather(*(process_and_report(name, load) for name, load in lectures))
+
+    wall_seconds = time.monotonic() - batch_started
+    total_cards = sum(len(result["cards"]) for result in results)
+    summary = {
+        "lectures": len(results),
+        "failed": sum(1 for result in results if result["error"]),
+        "cards": total_cards,
+        "wall_seconds": wall_seconds,
+        "lectures_per_minute": 60 * len(results) / wall_seconds if wall_seconds else 0.0,
+        "cards_per_minute": 60 * total_cards / wall_seconds if wall_seconds else 0.0,
+    }
+    return results, summary
+
+def batch_results_zip(results):
+    """Zip one JSON card set per successfully generated lecture"""
+    import zipfile
+    from pathlib import Path
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            if not result["error"]:
+                archive.writestr(Path(result["lecture"]).stem + ".json", json.dumps(result, indent=2))
+    return buffer.getvalue()
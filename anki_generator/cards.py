@@ -0,0 +1,223 @@
+"""Card parsing, salvage of partial responses and duplicate detection"""
+import json
+
+from .outline import _STOPWORDS
+
+def parse_cards_response(response_text):
+    """Parse the LLM's JSON array of cards, handling potential markdown wrapping"""
+    response_text = response_text.strip()
+    if response_text.startswith("```json"):
+        response_text = response_text[7:]  # Remove ```json
+    if response_text.startswith("```"):
+        response_text = response_text[3:]  # Remove ```
+    if response_text.endswith("```"):
+        response_text = response_text[:-3]  # Remove trailing ```
+    response_text = response_text.strip()
+
+    return json.loads(response_text)
+
+def salvage_cards(response_text):
+    """Recover every complete card from a truncated or malformed JSON response
+
+    Returns (cards, dropped) where dropped counts card objects that were
+    cut off or could not be decoded.
+    """
+    parser = CardStreamParser()
+    cards = parser.feed(response_text)
+    return cards, parser.dropped + (1 if parser.incomplete else 0)
+
+class CardStreamParser:
+    """Incremental parser that pulls complete card objects out of a streamed JSON array
+
+    Text is fed in arbitrary pieces; every top-level object is decoded as
+    soon as its closing brace arrives. Anything before the opening bracket
+    (such as a markdown fence) is ignored, and objects that fail to decode
+    are counted in `dropped` instead of aborting the stream. `closed` turns
+    true once the array's closing bracket has been seen.
+    """
+
+    def __init__(self):
+        self.dropped = 0
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+        self._started = False
+        self.closed = False
+
+    @property
+    def incomplete(self):
+        """True while a card object has been opened but not closed (e.g. a cut-off response)"""
+        return self._object_start is not None
+
+    def feed(self, text):
+        """Consume the next piece of text and return the cards it completed"""
+        self._buffer += text
+        cards = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if not self._started:
+                if char == "[":
+                    self._started = True
+                    self._depth = 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 1 and char == "{":
+                    self._object_start = i
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.closed = True
+                if self._depth == 1 and char == "}" and self._object_start is not None:
+                    try:
+                        card = json.loads(buffer[self._object_start:i + 1])
+                        if isinstance(card, dict):
+                            cards.append(card)
+                        else:
+                            self.dropped += 1
+                    except json.JSONDecodeError:
+                        self.dropped += 1
+                    self._object_start = None
+            i += 1
+
+        # Keep only the unfinished object so the buffer does not grow with the response
+        keep_from = self._object_start if self._object_start is not None else i
+        self._buffer = buffer[keep_from:]
+        self._pos = i - keep_from
+        if self._object_start is not None:
+            self._object_start = 0
+        return cards
+
+def _card_key(card):
+    """Normalized identity of a card's question for exact-duplicate detection"""
+    import re
+
+    content = card.get('text', '') if card.get('type') == 'cloze' else card.get('front', '')
+    return card.get('type', 'basic'), re.sub(r"[^a-z0-9]+", " ", content.lower()).strip()
+
+def dedupe_cards(cards):
+    """Drop cards whose normalized question repeats an earlier card"""
+    seen = set()
+    unique = []
+    for card in cards:
+        key = _card_key(card)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(card)
+    return unique
+
+# Shingle Jaccard similarity at or above which two cards count as near-duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.7
+
+def _card_shingles(card):
+    """Content words of a card's normalized question and answer text"""
+    import re
+
+    if card.get('type') == 'cloze':
+        content = re.sub(r"\{\{c\d+::(.*?)(::.*?)?\}\}", r"\1", card.get('text', ''))
+    else:
+        content = f"{card.get('front', '')} {card.get('back', '')}"
+    # Crude plural folding so "receptor" and "receptors" match
+    return {
+        word[:-1] if len(word) > 3 and word.endswith('s') else word
+        for word in re.sub(r"[^a-z0-9]+", " ", content.lower()).split()
+        if word not in _STOPWORDS
+    }
+
+class NearDuplicateIndex:
+    """MinHash/LSH index over card shingles for sub-linear near-duplicate lookups
+
+    Each card is reduced to a MinHash signature split into bands; only cards
+    sharing at least one band bucket are compared, by exact Jaccard
+    similarity of their shingle sets. With 16 bands of 4 rows, pairs above
+    ~0.5 similarity almost always share a bucket.
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD, num_perm=64, bands=16):
+        import random
+
+        rng = random.Random(0)
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        # XOR masks stand in for independent hash functions over the 32-bit shingle hashes
+        self._masks = [rng.getrandbits(32) for _ in range(num_perm)]
+        self._buckets = {}
+        # id(card) -> (card, shingles, band keys) for every indexed card
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_keys(self, shingles):
+        import zlib
+
+        hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]
+        signature = [min([h ^ mask for h in hashes]) for mask in self._masks]
+        return [
+            (band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+
+    def _entry(self, card):
+        shingles = _card_shingles(card)
+        return card, shingles, self._band_keys(shingles) if shingles else []
+
+    def find(self, card):
+        """Most similar indexed card at or above the threshold, as (card, similarity), or None"""
+        return self._find(self._entry(card))
+
+    def _find(self, entry):
+        _, shingles, band_keys = entry
+        candidates = set()
+        for band_key in band_keys:
+            candidates.update(self._buckets.get(band_key, ()))
+        best = None
+        for entry_id in candidates:
+            other_card, other, _ = self._entries[entry_id]
+            similarity = len(shingles & other) / len(shingles | other)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (other_card, similarity)
+        return best
+
+    def add(self, card):
+        self._add(self._entry(card))
+
+    def _add(self, entry):
+        card, _, band_keys = entry
+        self._entries[id(card)] = entry
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, set()).add(id(card))
+
+    def check_and_add(self, card, add_duplicates=False):
+        """find() then add() with one signature computation; duplicates are only added if add_duplicates"""
+        entry = self._entry(card)
+        match = self._find(entry)
+        if match is None or add_duplicates:
+            self._add(entry)
+        return match
+
+    def remove(self, card):
+        entry = self._entries.pop(id(card), None)
+        if entry is None:
+            return
+        for band_key in entry[2]:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(id(card))
+                if not bucket:
+                    del self._buckets[band_key]
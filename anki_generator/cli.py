@@ -0,0 +1,295 @@
+"""Command line: lecture PDF -> cards.json -> deck.apkg, without Streamlit
+
+    python -m anki_generator cards lecture.pdf -o cards.json
+    python -m anki_generator deck cards.json -o deck.apkg
+    python -m anki_generator deck cards.json -o deck.apkg --incremental
+    python -m anki_generator run lecture.pdf -o deck.apkg
+    python -m anki_generator run lecture.pdf -o deck.apkg --images
+    python -m anki_generator batch lectures/ -o card_sets/
+
+The API key comes from --api-key or the ANTHROPIC_API_KEY environment
+variable; every other setting the web app reads from its secrets is read
+from the environment.
+"""
+import argparse
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+from .settings import get_setting
+
+DEFAULT_MODEL = "claude-sonnet-4-5-20250929"
+
+
+def _log(message):
+    print(message, file=sys.stderr)
+
+
+def _api_key(args):
+    api_key = args.api_key or get_setting("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise SystemExit("error: no API key; pass --api-key or set ANTHROPIC_API_KEY")
+    return api_key
+
+
+def _load_cards(path):
+    """Cards from a cards.json file: a list of cards, or an object with a "cards" list (batch output)"""
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return data["cards"] if isinstance(data, dict) else data
+
+
+def _media_dir(cards_path):
+    """Directory of slide images kept next to a cards JSON file"""
+    return Path(cards_path).with_suffix(".media")
+
+
+def _load_media(cards_path):
+    media_dir = _media_dir(cards_path)
+    if not media_dir.is_dir():
+        return {}
+    return {path.name: path.read_bytes() for path in media_dir.iterdir() if path.is_file()}
+
+
+def _save_media(cards_path, media):
+    if media:
+        media_dir = _media_dir(cards_path)
+        media_dir.mkdir(exist_ok=True)
+        for filename, data in media.items():
+            (media_dir / filename).write_bytes(data)
+
+
+def _generate(args, pdf_path):
+    """Extract, compact and generate cards for one PDF; returns (cards, media, error)
+
+    media maps the filenames of slide images attached to cards (with
+    --images) to their bytes.
+    """
+    from .compaction import compact_extraction
+    from .generation import generate_cards_chunked, generate_cards_with_claude
+    from .pdf import extract_pdf_text
+
+    started = time.monotonic()
+    pdf_bytes = Path(pdf_path).read_bytes()
+    extracted = extract_pdf_text(io.BytesIO(pdf_bytes))
+    if not extracted:
+        return None, {}, f"could not extract text from {pdf_path}"
+    if not args.no_compact:
+        extracted = compact_extraction(extracted)
+    _log(
+        f"extracted {extracted['metadata']['page_count']} pages in {time.monotonic() - started:.2f}s"
+        + (f" ({extracted['compaction']['tokens_saved']:,} tokens of boilerplate removed)" if not args.no_compact else "")
+    )
+
+    title = args.title or extracted["metadata"]["title"]
+    if title == "Unknown":
+        title = Path(pdf_path).stem
+    report = {}
+    started = time.monotonic()
+    if args.chunked:
+        cards, error = generate_cards_chunked(
+            extracted["pages"], args.num_cards, _api_key(args), args.model, title, args.guidance,
+            report=report, force_regenerate=args.force, fill_missing=True
+        )
+    else:
+        cards, error = generate_cards_with_claude(
+            extracted["full_text"], args.num_cards, _api_key(args), args.model, title, args.guidance,
+            report=report, force_regenerate=args.force, fill_missing=True
+        )
+    if not cards:
+        return cards, {}, error
+    usage = report.get("usage", {})
+    _log(
+        f"generated {len(cards)} cards in {time.monotonic() - started:.2f}s"
+        + (" (response cache)" if report.get("cache_hit") else
+           f" ({usage.get('input_tokens', 0):,} input / {usage.get('output_tokens', 0):,} output tokens)")
+    )
+
+    media = {}
+    if args.images:
+        from .media import attach_slide_images, extract_slide_media
+
+        try:
+            slide_media = extract_slide_media(pdf_bytes)
+        except ImportError:
+            return cards, {}, "Please install Pillow: pip install Pillow"
+        attached = attach_slide_images(cards, extracted["pages"], slide_media)
+        media = {filename: slide_media["files"][filename] for card in cards for filename in card.get("images", ())}
+        stats = slide_media["stats"]
+        _log(
+            f"kept {stats['images_kept']} of {stats['images_found']} slide images "
+            f"({stats['bytes_before'] / 1e6:.1f} MB -> {stats['bytes_after'] / 1e6:.1f} MB in {stats['seconds']:.1f}s); "
+            f"attached to {attached} cards"
+        )
+    return cards, media, error
+
+
+def _manifest_path(output):
+    """Export manifest kept next to the .apkg: GUID -> content hash of every note exported so far"""
+    return Path(output).with_suffix(".manifest.json")
+
+
+def _write_deck(cards, output, deck_name, incremental=False, media=None):
+    from .export import export_apkg_file, plan_export
+
+    started = time.monotonic()
+    manifest = None
+    plan = None
+    if incremental:
+        manifest_path = _manifest_path(output)
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {}
+        plan = plan_export(cards, manifest)
+        if not plan:
+            _log(f"no new or changed cards since the last export to {output}")
+            return None
+        _log(f"{len(plan)} of {len(cards)} cards are new or changed since the last export")
+    # Written straight to disk, so memory stays flat for course-wide decks
+    report = {}
+    _, error = export_apkg_file(cards, deck_name, output, manifest, media=media, report=report, plan=plan)
+    if error:
+        return error
+    if incremental:
+        manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+    _log(
+        f"wrote {report['notes']} notes and {report['images']} slide images to {output} "
+        f"({report['bytes']:,} bytes) in {time.monotonic() - started:.2f}s"
+    )
+    return None
+
+
+def cmd_cards(args):
+    cards, media, error = _generate(args, args.pdf)
+    if error:
+        _log(f"error: {error}")
+        return 1
+    output = args.output or str(Path(args.pdf).with_suffix(".cards.json"))
+    Path(output).write_text(json.dumps(cards, indent=2), encoding="utf-8")
+    _save_media(output, media)
+    _log(f"wrote {output}" + (f" and {len(media)} slide images to {_media_dir(output)}" if media else ""))
+    return 0
+
+
+def cmd_deck(args):
+    cards = _load_cards(args.cards)
+    output = args.output or str(Path(args.cards).with_suffix(".apkg"))
+    error = _write_deck(
+        cards, output, args.name or Path(args.cards).stem, args.incremental, _load_media(args.cards)
+    )
+    if error:
+        _log(f"error: {error}")
+        return 1
+    return 0
+
+
+def cmd_run(args):
+    cards, media, error = _generate(args, args.pdf)
+    if error:
+        _log(f"error: {error}")
+        return 1
+    output = args.output or str(Path(args.pdf).with_suffix(".apkg"))
+    cards_path = Path(output).with_suffix(".cards.json")
+    cards_path.write_text(json.dumps(cards, indent=2), encoding="utf-8")
+    _save_media(cards_path, media)
+    error = _write_deck(cards, output, args.name or Path(args.pdf).stem, args.incremental, media)
+    if error:
+        _log(f"error: {error}")
+        return 1
+    return 0
+
+
+def cmd_batch(args):
+    import asyncio
+
+    from .batch import run_batch_generation
+
+    sources = args.sources[0] if len(args.sources) == 1 and Path(args.sources[0]).is_dir() else args.sources
+    results, summary = asyncio.run(run_batch_generation(
+        sources, args.num_cards, _api_key(args), args.model, args.guidance,
+        output_dir=args.output,
+        extract_concurrency=args.extract_concurrency,
+        api_concurrency=args.api_concurrency,
+        chunked=args.chunked,
+        on_progress=lambda result: _log(
+            f"{result['lecture']}: " + (f"error: {result['error']}" if result["error"] else
+                                        f"{len(result['cards'])} cards in {result['total_seconds']:.1f}s")
+        )
+    ))
+    Path(args.output, "summary.json").write_text(
+        json.dumps({"summary": summary, "lectures": [
+            {key: value for key, value in result.items() if key != "cards"} for result in results
+        ]}, indent=2),
+        encoding="utf-8"
+    )
+    _log(
+        f"{summary['lectures'] - summary['failed']}/{summary['lectures']} lectures, {summary['cards']:,} cards "
+        f"in {summary['wall_seconds']:.1f}s ({summary['lectures_per_minute']:.1f} lectures/min)"
+    )
+    return 1 if summary["failed"] else 0
+
+
+def _add_generation_options(parser):
+    parser.add_argument("-n", "--num-cards", type=int, default=20, help="cards per lecture (default: 20)")
+    parser.add_argument("--model", default=get_setting("ANTHROPIC_MODEL", DEFAULT_MODEL))
+    parser.add_argument("--api-key", help="Anthropic API key (default: $ANTHROPIC_API_KEY)")
+    parser.add_argument("--guidance", default="", help="additional instructions for the card writer")
+    parser.add_argument("--chunked", action="store_true", help="cover the whole lecture with per-section requests")
+
+
+def _add_lecture_options(parser):
+    parser.add_argument("--title", help="lecture title (default: PDF title or file name)")
+    parser.add_argument("--no-compact", action="store_true", help="keep repeated slide headers and footers")
+    parser.add_argument("--force", action="store_true", help="ignore the response cache")
+    parser.add_argument("--images", action="store_true",
+                        help="attach each card's slide image (deduplicated and downscaled) as deck media")
+
+
+def _add_deck_options(parser):
+    parser.add_argument("--name", help="deck name (default: file name)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only package notes that are new or changed since the last export to this path "
+                             "(tracked in <output>.manifest.json)")
+
+
+def build_parser():
+    from .batch import BATCH_API_CONCURRENCY, BATCH_EXTRACT_CONCURRENCY
+
+    parser = argparse.ArgumentParser(prog="anki_generator", description="Generate ANKI flashcards from lecture PDFs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cards = commands.add_parser("cards", help="lecture PDF -> cards.json")
+    cards.add_argument("pdf")
+    cards.add_argument("-o", "--output", help="cards JSON path (default: <pdf>.cards.json)")
+    _add_generation_options(cards)
+    _add_lecture_options(cards)
+    cards.set_defaults(func=cmd_cards)
+
+    deck = commands.add_parser("deck", help="cards.json -> deck.apkg")
+    deck.add_argument("cards")
+    deck.add_argument("-o", "--output", help=".apkg path (default: <cards>.apkg)")
+    _add_deck_options(deck)
+    deck.set_defaults(func=cmd_deck)
+
+    run = commands.add_parser("run", help="lecture PDF -> deck.apkg (keeps the cards JSON alongside)")
+    run.add_argument("pdf")
+    run.add_argument("-o", "--output", help=".apkg path (default: <pdf>.apkg)")
+    _add_deck_options(run)
+    _add_generation_options(run)
+    _add_lecture_options(run)
+    run.set_defaults(func=cmd_run)
+
+    batch = commands.add_parser("batch", help="one cards JSON per lecture PDF")
+    batch.add_argument("sources", nargs="+", help="a directory of PDFs, or PDF paths")
+    batch.add_argument("-o", "--output", required=True, help="output directory")
+    _add_generation_options(batch)
+    batch.add_argument("--extract-concurrency", type=int,
+                       default=int(get_setting("BATCH_EXTRACT_CONCURRENCY", BATCH_EXTRACT_CONCURRENCY)))
+    batch.add_argument("--api-concurrency", type=int,
+                       default=int(get_setting("BATCH_API_CONCURRENCY", BATCH_API_CONCURRENCY)))
+    batch.set_defaults(func=cmd_batch)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,99 @@
+"""Lecture text compaction: strip repeated slide headers/footers and tidy extracted text"""
+import re
+
+from .pdf import _assemble_pdf_result
+from .tokens import estimate_tokens
+
+# A line recurring on at least this share of pages (and on 3 or more) is treated as a slide header/footer
+BOILERPLATE_MIN_PAGE_SHARE = 0.5
+
+# Typographic ligatures, soft hyphens and no-break spaces left in extracted slide text
+_LIGATURES = str.maketrans({
+    "\ufb00": "ff", "\ufb01": "fi", "\ufb02": "fl", "\ufb03": "ffi", "\ufb04": "ffl",
+    "\ufb05": "st", "\ufb06": "st", "\u00ad": "", "\u00a0": " ",
+})
+
+# A word hyphenated across a line break, and the words used to decide whether to drop the hyphen
+_LINE_BREAK_HYPHEN = re.compile(r"(\w*[a-z])-[ \t]*\n[ \t]*([a-z]\w*)")
+_WORD = re.compile(r"\w+")
+
+# Lines that are only a page or slide number, after digits are masked
+_PAGE_NUMBER_LINE = re.compile(r"^(page|slide|p\.)?\s*#(\s*(/|of)\s*#)?$")
+
+def _boilerplate_key(line):
+    """Normalized line with leading/trailing numbers masked, so 'Slide 3 of 40' matches on every page"""
+    line = " ".join(line.lower().split())
+    return re.sub(r"^\d+\b|\b\d+$", "#", re.sub(r"\b\d+ (/|of) \d+\b", "# of #", line))
+
+def compact_pages(pages, min_page_share=BOILERPLATE_MIN_PAGE_SHARE, edge_lines=2):
+    """Strip repeated slide headers/footers and normalize the text of each page
+
+    Lines at the top or bottom of a page that recur across a large share of
+    pages (course titles, lecturer names, copyright footers, slide numbers)
+    are removed, ligatures are expanded, words hyphenated across line breaks
+    are rejoined (keeping the hyphen unless the lecture spells the word
+    unhyphenated elsewhere) and whitespace is collapsed. Returns (pages, stats) where stats gives the
+    characters and estimated tokens saved.
+    """
+    import math
+    from collections import Counter
+
+    texts = [page["text"].translate(_LIGATURES) for page in pages]
+    vocabulary = set(_WORD.findall("\n".join(texts).lower()))
+
+    def rejoin(match):
+        # "cardiomyo-\npathy" loses its hyphen only if the lecture uses "cardiomyopathy" elsewhere;
+        # compounds that wrap ("beta-\nblocker", "X-\nlinked") keep theirs
+        left, right = match.group(1), match.group(2)
+        return left + ("" if (left + right).lower() in vocabulary else "-") + right
+
+    normalized = []
+    for text in texts:
+        text = _LINE_BREAK_HYPHEN.sub(rejoin, text)
+        normalized.append([" ".join(line.split()) for line in text.splitlines()])
+
+    # Headers and footers sit in the first or last few lines of a page; body text is never a candidate
+    line_pages = Counter()
+    for lines in normalized:
+        lines[:] = [line for line in lines if line]
+        edges = lines[:edge_lines] + lines[-edge_lines:]
+        line_pages.update({_boilerplate_key(line) for line in edges})
+    min_pages = max(3, math.ceil(len(pages) * min_page_share))
+    boilerplate = {key for key, count in line_pages.items() if count >= min_pages}
+
+    compacted = []
+    lines_removed = 0
+    for page, lines in zip(pages, normalized):
+        kept = []
+        for position, line in enumerate(lines):
+            at_edge = position < edge_lines or position >= len(lines) - edge_lines
+            key = _boilerplate_key(line)
+            if at_edge and (key in boilerplate or _PAGE_NUMBER_LINE.match(key)):
+                lines_removed += 1
+                continue
+            kept.append(line)
+        compacted.append({"page": page["page"], "text": "\n".join(kept)})
+
+    before = "\n\n".join(page["text"] for page in pages)
+    after = "\n\n".join(page["text"] for page in compacted)
+    stats = {
+        "lines_removed": lines_removed,
+        "chars_before": len(before),
+        "chars_after": len(after),
+        "tokens_before": estimate_tokens(before),
+        "tokens_after": estimate_tokens(after),
+    }
+    stats["chars_saved"] = stats["chars_before"] - stats["chars_after"]
+    stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+    return compacted, stats
+
+def compact_extraction(result):
+    """Extraction result with compacted pages and full text, plus a "compaction" stats entry
+
+    The input result (which may be shared through the PDF text cache) is
+    left untouched.
+    """
+    pages, stats = compact_pages(result["pages"])
+    compacted = _assemble_pdf_result(pages, result["metadata"])
+    compacted["compaction"] = stats
+    return compacted
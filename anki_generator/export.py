@@ -0,0 +1,530 @@
+"""ANKI .apkg export with genanki"""
+import io
+import json
+import os
+import time
+
+from .settings import shared
+
+# Bump when a model's fields, templates or CSS change so Anki imports it as a new note type
+MODEL_TEMPLATE_VERSION = 2
+
+def stable_id(*parts):
+    """ID in genanki's usual [2**30, 2**31) range derived from parts, the same in every process
+
+    Anki matches note types and decks by ID on import, so deriving them from
+    names (instead of random IDs) updates the existing ones rather than
+    adding a copy on every import.
+    """
+    import hashlib
+
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).digest()
+    return (1 << 30) + int.from_bytes(digest[:8], "big") % (1 << 30)
+
+@shared
+def create_medical_model():
+    """Create a custom ANKI model for medical flashcards with styling (built once per process)"""
+    import genanki
+    
+    model_name = 'Medical Flashcard (STEP 1)'
+    
+    return genanki.Model(
+        stable_id("model", model_name, MODEL_TEMPLATE_VERSION),
+        model_name,
+        fields=[
+            {'name': 'Front'},
+            {'name': 'Back'},
+            {'name': 'Source'},
+            {'name': 'OrganSystem'},
+            {'name': 'USMLECategory'},
+            {'name': 'Image'},
+        ],
+        templates=[
+            {
+                'name': 'Card 1',
+                'qfmt': '''<div class="card-front">
+    <div class="question">{{Front}}</div>
+</div>''',
+                'afmt': '''<div class="card-back">
+    <div class="question">{{Front}}</div>
+    <hr>
+    <div class="answer">{{Back}}</div>
+    {{#Image}}<div class="image">{{Image}}</div>{{/Image}}
+    <div class="source">{{Source}}</div>
+    <div class="categories">
+        <span class="category">🧬 {{OrganSystem}}</span>
+        <span class="category">📋 {{USMLECategory}}</span>
+    </div>
+</div>''',
+            },
+        ],
+        css='''.card {
+    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
+    font-size: 18px;
+    text-align: left;
+    color: #12312B;
+    background-color: #ffffff;
+    padding: 20px;
+    line-height: 1.6;
+}
+
+.card-front, .card-back {
+    max-width: 600px;
+    margin: 0 auto;
+}
+
+.question {
+    font-size: 20px;
+    font-weight: 600;
+    color: #12312B;
+    margin-bottom: 15px;
+    padding: 15px;
+    background-color: #f7f7f7;
+    border-left: 4px solid #00693E;
+    border-radius: 4px;
+}
+
+.answer {
+    font-size: 18px;
+    color: #000000;
+    margin: 20px 0;
+    padding: 15px;
+    background-color: #f7f7f7;
+    border-radius: 4px;
+    border-left: 3px solid #267ABA;
+}
+
+.source {
+    font-size: 14px;
+    color: #707070;
+    font-style: italic;
+    margin-top: 15px;
+    padding-top: 10px;
+    border-top: 1px solid #e2e2e2;
+}
+
+.categories {
+    margin-top: 10px;
+    font-size: 13px;
+}
+
+.category {
+    display: inline-block;
+    background-color: #f7f7f7;
+    color: #00693E;
+    padding: 4px 8px;
+    border-radius: 4px;
+    margin-right: 8px;
+    font-weight: 500;
+    border: 1px solid #e2e2e2;
+}
+
+hr {
+    border: none;
+    border-top: 2px solid #e2e2e2;
+    margin: 15px 0;
+}
+
+.cloze {
+    font-weight: bold;
+    color: #00693E;
+}
+
+.image {
+    margin: 15px 0;
+    text-align: center;
+}
+
+.image img {
+    max-width: 100%;
+    height: auto;
+    border-radius: 4px;
+}'''
+    )
+
+@shared
+def create_cloze_model():
+    """Create a custom ANKI cloze model for medical flashcards (built once per process)"""
+    import genanki
+    
+    model_name = 'Medical Cloze (STEP 1)'
+    
+    return genanki.Model(
+        stable_id("model", model_name, MODEL_TEMPLATE_VERSION),
+        model_name,
+        fields=[
+            {'name': 'Text'},
+            {'name': 'Source'},
+            {'name': 'OrganSystem'},
+            {'name': 'USMLECategory'},
+            {'name': 'Image'},
+        ],
+        templates=[
+            {
+                'name': 'Cloze',
+                'qfmt': '''<div class="card-front">
+    <div class="question">{{cloze:Text}}</div>
+</div>''',
+                'afmt': '''<div class="card-back">
+    <div class="question">{{cloze:Text}}</div>
+    {{#Image}}<div class="image">{{Image}}</div>{{/Image}}
+    <div class="source">{{Source}}</div>
+    <div class="categories">
+        <span class="category">🧬 {{OrganSystem}}</span>
+        <span class="category">📋 {{USMLECategory}}</span>
+    </div>
+</div>''',
+            },
+        ],
+        css='''.card {
+    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
+    font-size: 18px;
+    text-align: left;
+    color: #12312B;
+    background-color: #ffffff;
+    padding: 20px;
+    line-height: 1.6;
+}
+
+.card-front, .card-back {
+    max-width: 600px;
+    margin: 0 auto;
+}
+
+.question {
+    font-size: 20px;
+    font-weight: 600;
+    color: #12312B;
+    margin-bottom: 15px;
+    padding: 15px;
+    background-color: #f7f7f7;
+    border-left: 4px solid #00693E;
+    border-radius: 4px;
+}
+
+.source {
+    font-size: 14px;
+    color: #707070;
+    font-style: italic;
+    margin-top: 15px;
+    padding-top: 10px;
+    border-top: 1px solid #e2e2e2;
+}
+
+.categories {
+    margin-top: 10px;
+    font-size: 13px;
+}
+
+.category {
+    display: inline-block;
+    background-color: #f7f7f7;
+    color: #00693E;
+    padding: 4px 8px;
+    border-radius: 4px;
+    margin-right: 8px;
+    font-weight: 500;
+    border: 1px solid #e2e2e2;
+}
+
+.cloze {
+    font-weight: bold;
+    color: #00693E;
+    background-color: #f7f7f7;
+    padding: 2px 6px;
+    border-radius: 3px;
+    border: 1px solid #e2e2e2;
+}
+
+.image {
+    margin: 15px 0;
+    text-align: center;
+}
+
+.image img {
+    max-width: 100%;
+    height: auto;
+    border-radius: 4px;
+}''',
+        model_type=genanki.Model.CLOZE
+    )
+
+def _apply_anki_compat(cursor):
+    """Schema additions ANKI 2.1.28+ expects, applied to the collection before it is packaged"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS graves (
+            usn integer not null,
+            oid integer not null,
+            type integer not null
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dconf (
+            id integer primary key,
+            conf text not null,
+            usn integer not null default -1
+        )
+    """)
+    decks_json, models_json = cursor.execute("SELECT decks, models FROM col").fetchone()
+    decks = json.loads(decks_json)
+    models = json.loads(models_json)
+    for entry in list(decks.values()) + list(models.values()):
+        entry.setdefault('usn', -1)
+    cursor.execute("UPDATE col SET decks = ?, models = ?", (json.dumps(decks), json.dumps(models)))
+
+def _serialize_database(conn):
+    """Bytes of a SQLite database file for an open connection"""
+    if hasattr(conn, "serialize"):
+        return conn.serialize()
+    # Python < 3.11: copy the in-memory database to a temporary file once
+    import sqlite3
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "collection.anki2")
+        target = sqlite3.connect(db_path)
+        try:
+            conn.backup(target)
+        finally:
+            target.close()
+        with open(db_path, 'rb') as f:
+            return f.read()
+
+def _write_collection(conn, package, timestamp):
+    """Write a genanki Package's collection into an open SQLite connection, ANKI 2.1.28+ compatible"""
+    import itertools
+
+    if timestamp is None:
+        timestamp = time.time()
+    cursor = conn.cursor()
+    package.write_to_db(cursor, timestamp, itertools.count(int(timestamp * 1000)))
+    _apply_anki_compat(cursor)
+    conn.commit()
+
+def _zip_package(target, package, write_collection, media=None):
+    """Zip an .apkg into target (a path or file object); write_collection(archive) adds collection.anki2
+
+    media ({filename: bytes}) is packaged alongside the package's own
+    media_files paths. Media is stored uncompressed: it is already JPEG.
+    """
+    import zipfile
+
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as archive:
+        write_collection(archive)
+        media_files = dict(enumerate(package.media_files))
+        media_names = {idx: os.path.basename(path) for idx, path in media_files.items()}
+        media_data = dict(enumerate((media or {}).items(), start=len(media_files)))
+        media_names.update((idx, filename) for idx, (filename, _) in media_data.items())
+        archive.writestr('media', json.dumps(media_names))
+        for idx, path in media_files.items():
+            archive.write(path, str(idx))
+        for idx, (_, data) in media_data.items():
+            archive.writestr(str(idx), data, compress_type=zipfile.ZIP_STORED)
+
+def package_to_bytes(package, timestamp=None, media=None):
+    """Build a genanki Package as .apkg bytes in one pass, without temporary files
+
+    The collection is written into an in-memory SQLite database, made
+    ANKI 2.1.28+ compatible in place, serialized and zipped straight into a
+    bytes buffer.
+    """
+    import sqlite3
+
+    conn = sqlite3.connect(":memory:")
+    try:
+        _write_collection(conn, package, timestamp)
+        db_bytes = _serialize_database(conn)
+    finally:
+        conn.close()
+
+    buffer = io.BytesIO()
+    _zip_package(buffer, package, lambda archive: archive.writestr('collection.anki2', db_bytes), media)
+    return buffer.getvalue()
+
+def package_to_file(package, path, timestamp=None, media=None):
+    """Build a genanki Package as an .apkg file at path, keeping memory flat for any deck size
+
+    The collection database is written to a temporary file next to path and
+    zipped from disk in chunks, so neither the database nor the package is
+    ever held in memory as a whole.
+    """
+    import sqlite3
+    import tempfile
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as temp_dir:
+        db_path = os.path.join(temp_dir, "collection.anki2")
+        conn = sqlite3.connect(db_path)
+        try:
+            # A scratch file that is zipped and deleted: skip the journal and fsyncs
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            _write_collection(conn, package, timestamp)
+        finally:
+            conn.close()
+        _zip_package(path, package, lambda archive: archive.write(db_path, 'collection.anki2'), media)
+    return path
+
+def _note_fields(card):
+    """(is_cloze, field values) of the note for a card, in its model's field order"""
+    # Slide images attached by attach_slide_images, shipped as package media
+    image = "".join(f'<img src="{filename}">' for filename in card.get('images', ()))
+    if card.get('type', 'basic').lower() == 'cloze':
+        # Cloze card - cloze model with a Text field
+        return True, [
+            card.get('text', ''),
+            card.get('source', ''),
+            card.get('organ_system', ''),
+            card.get('usmle_category', ''),
+            image
+        ]
+    # Basic card - basic model with Front/Back fields
+    return False, [
+        card.get('front', ''),
+        card.get('back', ''),
+        card.get('source', ''),
+        card.get('organ_system', ''),
+        card.get('usmle_category', ''),
+        image
+    ]
+
+def plan_export(cards, manifest=None):
+    """(card, guid, content hash) for each card to export, skipping ones unchanged in manifest
+
+    A note's GUID comes from the lecture source and the field that identifies
+    the card (front or cloze text), so regenerating a lecture with a
+    corrected back or category yields the same GUID and Anki updates the
+    note in place. The content hash covers every field; manifest maps GUIDs
+    to the hash last exported, and cards whose hash matches are left out.
+    """
+    import genanki
+    import hashlib
+
+    plan = []
+    occurrences = {}
+    for card in cards:
+        is_cloze, fields = _note_fields(card)
+        key = ("cloze" if is_cloze else "basic", card.get('source', ''), fields[0])
+        # Identical keys in one deck get numbered so they stay distinct notes
+        occurrences[key] = occurrences.get(key, 0) + 1
+        guid = genanki.guid_for(*key, occurrences[key])
+        content_hash = hashlib.sha256(
+            json.dumps([MODEL_TEMPLATE_VERSION, is_cloze, fields]).encode("utf-8")
+        ).hexdigest()
+        if manifest is None or manifest.get(guid) != content_hash:
+            plan.append((card, guid, content_hash))
+    return plan
+
+class _ReiterableNotes:
+    """Stands in for Deck.notes: each pass calls make_notes() for a fresh generator"""
+
+    def __init__(self, make_notes):
+        self._make_notes = make_notes
+
+    def __iter__(self):
+        return self._make_notes()
+
+def _build_package(selected_cards, deck_name, manifest, plan=None):
+    """(genanki Package, export plan) for the cards to export; the plan is empty if nothing changed"""
+    import genanki
+    
+    # Both models are shared by every export in this process
+    basic_model = create_medical_model()
+    cloze_model = create_cloze_model()
+    
+    deck = genanki.Deck(stable_id("deck", deck_name), deck_name)
+    
+    if plan is None:
+        plan = plan_export(selected_cards, manifest)
+    
+    def notes():
+        # Add cards with appropriate model
+        for card, guid, _ in plan:
+            is_cloze, fields = _note_fields(card)
+            yield genanki.Note(
+                model=cloze_model if is_cloze else basic_model,
+                fields=fields,
+                guid=guid
+            )
+    
+    # genanki only iterates deck.notes, so notes are built as they are written rather than all held at once
+    deck.notes = _ReiterableNotes(notes)
+    return genanki.Package(deck), plan
+
+def _record_export(manifest, plan):
+    if manifest is not None:
+        manifest.update((guid, content_hash) for _, guid, content_hash in plan)
+
+def _plan_media(plan, media):
+    """The media files ({filename: bytes}) referenced by the cards being exported"""
+    if not media:
+        return {}
+    return {
+        filename: media[filename]
+        for card, _, _ in plan
+        for filename in card.get('images', ())
+        if filename in media
+    }
+
+def _report_export(report, plan, package_media, package_bytes, started):
+    if report is not None:
+        report.update({
+            "notes": len(plan),
+            "images": len(package_media),
+            "media_bytes": sum(len(data) for data in package_media.values()),
+            "bytes": package_bytes,
+            "seconds": time.monotonic() - started,
+        })
+
+def generate_apkg_file(selected_cards, deck_name, manifest=None, media=None, report=None, plan=None):
+    """Generate .apkg file directly and return the file bytes
+
+    With a manifest (GUID -> content hash of earlier exports of this deck),
+    only new or changed notes are packaged and the manifest is updated with
+    them once the package is built. Slide images the cards reference are
+    packaged from media ({filename: bytes}). If report is a dict it receives
+    the note and image counts, package size and build time. A plan already
+    computed with plan_export(selected_cards, manifest) can be passed in so
+    the cards are not hashed twice.
+    """
+    try:
+        started = time.monotonic()
+        package, plan = _build_package(selected_cards, deck_name, manifest, plan)
+        if not plan:
+            return None, "No new or changed cards since the last export of this deck"
+        
+        package_media = _plan_media(plan, media)
+        apkg_bytes = package_to_bytes(package, media=package_media)
+        _record_export(manifest, plan)
+        _report_export(report, plan, package_media, len(apkg_bytes), started)
+        return apkg_bytes, None
+        
+    except ImportError:
+        return None, "Please install genanki: pip install genanki"
+    except Exception as e:
+        return None, f"Error generating .apkg file: {str(e)}"
+
+def export_apkg_file(selected_cards, deck_name, path, manifest=None, media=None, report=None, plan=None):
+    """Write the .apkg to path instead of returning its bytes, for decks too large to hold in memory
+
+    Same cards, GUIDs, manifest, media, report and plan handling as
+    generate_apkg_file; returns (path, error). A partly written file is
+    removed on error.
+    """
+    try:
+        started = time.monotonic()
+        package, plan = _build_package(selected_cards, deck_name, manifest, plan)
+        if not plan:
+            return None, "No new or changed cards since the last export of this deck"
+        
+        package_media = _plan_media(plan, media)
+        package_to_file(package, path, media=package_media)
+        _record_export(manifest, plan)
+        _report_export(report, plan, package_media, os.path.getsize(path), started)
+        return path, None
+        
+    except ImportError:
+        return None, "Please install genanki: pip install genanki"
+    except Exception as e:
+        if os.path.exists(path):
+            os.remove(path)
+        return None, f"Error generating .apkg file: {str(e)}"
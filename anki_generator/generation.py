@@ -0,0 +1,381 @@
+"""Card generation with Claude: single request, streaming and chunked over the whole lecture"""
+import json
+import time
+
+from .api import (
+    API_MAX_ATTEMPTS, api_error_message, call_with_retries, get_client_pool, get_rate_limiter,
+    get_response_cache, get_usage_stats, is_retryable_error, response_cache_key, retry_delay, usage_to_dict,
+)
+from .cards import CardStreamParser, _card_key, dedupe_cards, parse_cards_response, salvage_cards
+from .prompts import build_lecture_prompt, build_system_prompt
+from .tokens import (
+    LECTURE_TOKEN_BUDGET, calibrated_budget, estimate_tokens, get_token_telemetry, lecture_excerpt, size_max_tokens,
+    split_by_tokens,
+)
+
+def _add_usage(report, usage):
+    """Accumulate token usage into report["usage"]"""
+    totals = report.setdefault("usage", {})
+    for key, value in usage.items():
+        totals[key] = totals.get(key, 0) + value
+
+def request_missing_cards(client, model, system_prompt, pdf_content, missing, lecture_title="", custom_guidance="",
+                          existing_cards=(), report=None):
+    """Small follow-up request for cards lost from a truncated or malformed response
+
+    Returns at most `missing` new cards that do not repeat existing_cards.
+    Failures return an empty list: the cards already recovered still stand.
+    """
+    try:
+        prompt = build_lecture_prompt(pdf_content, missing, lecture_title, custom_guidance, existing_cards)
+        message = call_with_retries(
+            lambda: client.messages.create(
+                model=model,
+                max_tokens=size_max_tokens(model, missing),
+                system=system_prompt,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ]
+            ),
+            estimate_tokens(system_prompt[0]["text"] + prompt),
+            report
+        )
+    except Exception:
+        return []
+
+    usage = usage_to_dict(message.usage)
+    get_usage_stats().record(usage)
+    cards, _ = salvage_cards(message.content[0].text)
+    seen = {_card_key(card) for card in existing_cards}
+    recovered = [card for card in dedupe_cards(cards) if _card_key(card) not in seen][:missing]
+    if report is not None:
+        _add_usage(report, usage)
+        report["recovered"] = len(recovered)
+    return recovered
+
+def generate_cards_with_claude(pdf_text, num_cards, api_key, model, lecture_title="", custom_guidance="",
+                               report=None, force_regenerate=False, fill_missing=False, trim_to_budget=True):
+    """Generate flashcards using GenAI
+
+    Identical requests are answered from the on-disk response cache unless
+    force_regenerate is set. A truncated or malformed response keeps every
+    complete card; with fill_missing, a follow-up request asks for just the
+    cards that were lost. If a `report` dict is given it receives the token
+    usage (including prompt cache reads and writes), whether the response
+    cache was hit, and how many cards were dropped and recovered. Text that
+    is already sized to the budget (a chunk) is sent whole with
+    trim_to_budget=False.
+    """
+    try:
+        import anthropic
+        
+        # Validate PDF text
+        if not pdf_text or len(pdf_text.strip()) < 100:
+            return None, "PDF text is too short or empty. Please upload a PDF with more content."
+        
+        # Validate and clean API key
+        api_key = api_key.strip()
+        if not api_key.startswith('sk-ant-'):
+            return None, "Invalid API key format. Key should start with 'sk-ant-'"
+        
+        # Limit PDF text to the input token budget
+        pdf_content = lecture_excerpt(pdf_text, model) if trim_to_budget else pdf_text
+
+        response_cache = get_response_cache()
+        cache_key = response_cache_key(
+            pdf_text, model, num_cards, lecture_title, custom_guidance, LECTURE_TOKEN_BUDGET if trim_to_budget else None
+        )
+        if response_cache is not None and not force_regenerate:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                if report is not None:
+                    report["cache_hit"] = True
+                    report["usage"] = cached[1]
+                return cached[0], None
+
+        client = get_client_pool().get(api_key)
+        
+        # Create the prompt for Claude: a cached static system prompt plus the per-lecture content
+        system_prompt = build_system_prompt()
+        prompt = build_lecture_prompt(pdf_content, num_cards, lecture_title, custom_guidance)
+
+        # Call Claude API
+        # max_tokens sized from observed output tokens per card for this model
+        max_tokens = size_max_tokens(model, num_cards)
+        estimated_input_tokens = estimate_tokens(system_prompt[0]["text"] + prompt)
+        message = call_with_retries(
+            lambda: client.messages.create(
+                model=model,
+                max_tokens=max_tokens,
+                system=system_prompt,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ]
+            ),
+            estimated_input_tokens,
+            report
+        )
+
+        usage = usage_to_dict(message.usage)
+        get_usage_stats().record(usage)
+        if report is not None:
+            report["usage"] = usage
+            report["max_tokens"] = max_tokens
+        
+        # Extract response text and parse JSON, keeping every complete card if it is cut off or malformed
+        response_text = message.content[0].text
+        try:
+            cards = parse_cards_response(response_text)
+            dropped = 0
+        except json.JSONDecodeError:
+            cards, dropped = salvage_cards(response_text)
+            if not cards:
+                raise
+            # A cut-off response also loses every card after the last complete one
+            dropped = max(dropped, num_cards - len(cards))
+        if report is not None:
+            report["dropped"] = dropped
+        get_token_telemetry().record(model, estimated_input_tokens, usage, cards)
+
+        missing = num_cards - len(cards)
+        if dropped and missing > 0 and fill_missing:
+            cards.extend(request_missing_cards(
+                client, model, system_prompt, pdf_content, missing, lecture_title, custom_guidance, cards, report
+            ))
+
+        # A partial result is not cached, so the next attempt can produce the full set
+        if response_cache is not None and (not dropped or len(cards) >= num_cards):
+            response_cache.put(cache_key, cards, usage)
+        
+        return cards, None
+        
+    except json.JSONDecodeError as e:
+        return None, "Failed to parse LLM's response as JSON. Please try again."
+    except Exception as e:
+        return None, api_error_message(e)
+
+def stream_cards_with_claude(pdf_text, num_cards, api_key, model, lecture_title="", custom_guidance="",
+                             report=None, force_regenerate=False, fill_missing=False):
+    """Generate flashcards with a streamed response, yielding each card as soon as it is complete
+
+    Uses the same prompt, response cache and partial-response recovery as
+    generate_cards_with_claude. Errors are not raised: the generator stops
+    and puts a user-facing message in report["error"]. On success the
+    report receives the token usage, whether the response cache was hit,
+    and how many cards were dropped and recovered.
+    """
+    if report is None:
+        report = {}
+    try:
+        import anthropic
+
+        # Validate PDF text
+        if not pdf_text or len(pdf_text.strip()) < 100:
+            report["error"] = "PDF text is too short or empty. Please upload a PDF with more content."
+            return
+
+        # Validate and clean API key
+        api_key = api_key.strip()
+        if not api_key.startswith('sk-ant-'):
+            report["error"] = "Invalid API key format. Key should start with 'sk-ant-'"
+            return
+
+        pdf_content = lecture_excerpt(pdf_text, model)
+
+        response_cache = get_response_cache()
+        cache_key = response_cache_key(pdf_text, model, num_cards, lecture_title, custom_guidance, LECTURE_TOKEN_BUDGET)
+        if response_cache is not None and not force_regenerate:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                report["cache_hit"] = True
+                report["usage"] = cached[1]
+                yield from cached[0]
+                return
+
+        client = get_client_pool().get(api_key)
+        cards = []
+        system_prompt = build_system_prompt()
+        prompt = build_lecture_prompt(pdf_content, num_cards, lecture_title, custom_guidance)
+        max_tokens = size_max_tokens(model, num_cards)
+        estimated_tokens = estimate_tokens(system_prompt[0]["text"] + prompt)
+
+        for attempt in range(API_MAX_ATTEMPTS):
+            report["queue_seconds"] = report.get("queue_seconds", 0.0) + get_rate_limiter().acquire(estimated_tokens)
+            # A retry starts a new response, so text from a failed attempt must not be parsed with it
+            parser = CardStreamParser()
+            try:
+                with client.messages.stream(
+                    model=model,
+                    max_tokens=max_tokens,
+                    system=system_prompt,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ]
+                ) as stream:
+                    for text in stream.text_stream:
+                        for card in parser.feed(text):
+                            cards.append(card)
+                            yield card
+                    message = stream.get_final_message()
+                break
+            except Exception as e:
+                # Once cards have been shown a retry would duplicate them, so only retry clean failures
+                if cards or not is_retryable_error(e) or attempt + 1 >= API_MAX_ATTEMPTS:
+                    raise
+                report["retries"] = attempt + 1
+                time.sleep(retry_delay(attempt, e))
+
+        usage = usage_to_dict(message.usage)
+        get_usage_stats().record(usage)
+        get_token_telemetry().record(model, estimated_tokens, usage, cards)
+        report["usage"] = usage
+        report["max_tokens"] = max_tokens
+        dropped = parser.dropped + (1 if parser.incomplete else 0)
+        if not parser.closed:
+            # A cut-off response also loses every card after the last complete one
+            dropped = max(dropped, num_cards - len(cards))
+        report["dropped"] = dropped
+
+        missing = num_cards - len(cards)
+        if dropped and missing > 0 and fill_missing:
+            for card in request_missing_cards(
+                client, model, system_prompt, pdf_content, missing, lecture_title, custom_guidance, cards, report
+            ):
+                cards.append(card)
+                yield card
+
+        if response_cache is not None and cards and (not dropped or len(cards) >= num_cards):
+            response_cache.put(cache_key, cards, usage)
+
+    except Exception as e:
+        report["error"] = api_error_message(e)
+
+# Upper bound on concurrent API requests for one chunked generation
+GENERATION_MAX_CONCURRENCY = 4
+
+def chunk_pages(pages, token_budget=LECTURE_TOKEN_BUDGET):
+    """Group consecutive pages into chunks of at most token_budget estimated tokens
+
+    Chunks break on page boundaries; a single page larger than the budget is
+    split on its own. Each chunk is {"first_page", "last_page", "text"}.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append({
+                "first_page": current[0]["page"],
+                "last_page": current[-1]["page"],
+                "text": "\n\n".join(page["text"] for page in current)
+            })
+        current = []
+        current_tokens = 0
+
+    for page in pages:
+        page_tokens = estimate_tokens(page["text"])
+        if page_tokens > token_budget:
+            flush()
+            for piece in split_by_tokens(page["text"], token_budget):
+                chunks.append({
+                    "first_page": page["page"],
+                    "last_page": page["page"],
+                    "text": piece
+                })
+            continue
+        if current_tokens + page_tokens > token_budget:
+            flush()
+        current.append(page)
+        current_tokens += page_tokens
+    flush()
+    return chunks
+
+def allocate_cards(chunks, num_cards):
+    """Spread num_cards across chunks in proportion to their content
+
+    Counts come from rounding the cumulative share of content, so they sum
+    to num_cards and stay evenly spread even when there are more chunks
+    than cards.
+    """
+    weights = [estimate_tokens(chunk["text"]) for chunk in chunks]
+    total = sum(weights)
+    if not total:
+        return [0] * len(chunks)
+
+    counts = []
+    cumulative = 0
+    allocated = 0
+    for weight in weights:
+        cumulative += weight
+        target = round(num_cards * cumulative / total)
+        counts.append(target - allocated)
+        allocated = target
+    return counts
+
+def generate_cards_chunked(pages, num_cards, api_key, model, lecture_title="", custom_guidance="",
+                           max_concurrency=GENERATION_MAX_CONCURRENCY, report=None, force_regenerate=False,
+                           fill_missing=False):
+    """Generate flashcards over the whole lecture with concurrent per-chunk requests
+
+    The lecture is split into token-budgeted chunks on page boundaries,
+    num_cards is spread across chunks in proportion to their content, and
+    the chunk requests run concurrently (at most max_concurrency at a time).
+    Chunks are sized to the budget calibrated for the model and sent whole.
+    Results are merged in page order and de-duplicated. If a `report` dict
+    is given it receives the chunk count, any per-chunk errors and the
+    summed token usage.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Chunks too short to generate from would only fail validation
+    chunks = [
+        chunk for chunk in chunk_pages(pages, calibrated_budget(model))
+        if len(chunk["text"].strip()) >= 100
+    ]
+    if not chunks:
+        return None, "PDF text is too short or empty. Please upload a PDF with more content."
+
+    jobs = [(chunk, count) for chunk, count in zip(chunks, allocate_cards(chunks, num_cards)) if count > 0]
+
+    def run(job):
+        chunk, count = job
+        chunk_report = {}
+        cards, error = generate_cards_with_claude(
+            chunk["text"], count, api_key, model, lecture_title, custom_guidance,
+            report=chunk_report, force_regenerate=force_regenerate, fill_missing=fill_missing, trim_to_budget=False
+        )
+        return cards, error, chunk_report
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(jobs)))) as executor:
+        results = list(executor.map(run, jobs))
+
+    cards = []
+    errors = []
+    usage = {}
+    cache_hits = 0
+    dropped = 0
+    recovered = 0
+    for (chunk, _), (chunk_cards, error, chunk_report) in zip(jobs, results):
+        cache_hits += bool(chunk_report.get("cache_hit"))
+        dropped += chunk_report.get("dropped", 0)
+        recovered += chunk_report.get("recovered", 0)
+        for key, value in chunk_report.get("usage", {}).items():
+            usage[key] = usage.get(key, 0) + value
+        if error:
+            errors.append(f"Pages {chunk['first_page']}-{chunk['last_page']}: {error}")
+        elif chunk_cards:
+            cards.extend(chunk_cards)
+
+    if report is not None:
+        report["chunks"] = len(jobs)
+        report["errors"] = errors
+        report["usage"] = usage
+        report["cache_hit"] = bool(jobs) and cache_hits == len(jobs)
+        report["dropped"] = dropped
+        report["recovered"] = recovered
+
+    if not cards:
+        return None, errors[0].split(": ", 1)[1] if errors else "No cards were generated. Please try again."
+    return dedupe_cards(cards), None
@@ -0,0 +1,163 @@
+"""Slide images as deck media: extraction, dedup, downscaling and matching images to cards"""
+import io
+import os
+import time
+
+# Longest side and JPEG size each slide image is downscaled and recompressed to
+IMAGE_MAX_SIDE = 1024
+IMAGE_BYTE_BUDGET = 150_000
+# Images smaller than this on both sides (icons, bullets) are not worth a card
+IMAGE_MIN_SIDE = 96
+# Images on at least this share of pages (logos, template graphics) are dropped
+REPEATED_IMAGE_PAGE_SHARE = 0.5
+# BM25 score a card's best-matching page needs before that page's images are attached
+IMAGE_MATCH_MIN_SCORE = 6.0
+MAX_IMAGES_PER_CARD = 1
+
+def _downscale_image(data, max_side, byte_budget, min_side):
+    """JPEG bytes of an image fitted within max_side and byte_budget, or None if too small or unreadable"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) < min_side:
+                return None
+            # Lets the JPEG decoder skip straight to a reduced scale
+            image.draft("RGB", (max_side, max_side))
+            if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, "white")
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                image = image.convert("RGB")
+    except Exception:
+        return None
+
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    while True:
+        for quality in (80, 70, 60, 50):
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+            if buffer.tell() <= byte_budget:
+                return buffer.getvalue()
+        if max(image.size) <= min_side:
+            return buffer.getvalue()
+        image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)), Image.LANCZOS)
+
+def extract_slide_media(pdf_bytes, max_side=IMAGE_MAX_SIDE, byte_budget=IMAGE_BYTE_BUDGET,
+                        min_side=IMAGE_MIN_SIDE, min_page_share=REPEATED_IMAGE_PAGE_SHARE, workers=None):
+    """Pull the images out of a PDF's pages, deduplicated and downscaled for use as deck media
+
+    Images are keyed by the SHA-256 of their bytes, so an image repeated on
+    many slides is stored and processed once; ones on at least
+    min_page_share of the pages are treated as template graphics and
+    dropped. The rest are downscaled and recompressed to JPEG by a thread
+    pool (Pillow releases the GIL while decoding, resizing and encoding).
+
+    Returns {"files": {filename: bytes}, "pages": {page: [filename, ...]},
+    "stats": {...}}, with each page's images largest first. Filenames come
+    from the content hash, so they are the same in every export.
+    """
+    import hashlib
+    import importlib.util
+    import math
+    from concurrent.futures import ThreadPoolExecutor
+
+    from pypdf import PdfReader
+
+    # Pillow decodes and re-encodes the images: fail before any work if it is missing
+    if importlib.util.find_spec("PIL") is None:
+        raise ImportError("Pillow is required for slide images: pip install Pillow", name="PIL")
+
+    started = time.monotonic()
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    images = {}
+    image_pages = {}
+    found = 0
+    for page_number, page in enumerate(reader.pages, start=1):
+        try:
+            page_images = list(page.images)
+        except Exception:
+            continue
+        for page_image in page_images:
+            try:
+                data = page_image.data
+            except Exception:
+                continue
+            found += 1
+            sha256 = hashlib.sha256(data).hexdigest()
+            images.setdefault(sha256, data)
+            image_pages.setdefault(sha256, []).append(page_number)
+
+    page_count = len(reader.pages)
+    repeated_at = max(3, math.ceil(min_page_share * page_count))
+    kept = [sha256 for sha256, pages in image_pages.items() if len(set(pages)) < repeated_at]
+
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        downscaled = dict(zip(kept, executor.map(
+            lambda sha256: _downscale_image(images[sha256], max_side, byte_budget, min_side), kept
+        )))
+
+    files = {}
+    pages = {}
+    for sha256 in sorted(kept, key=lambda sha256: -len(images[sha256])):
+        if downscaled[sha256] is None:
+            continue
+        filename = f"slide-{sha256[:16]}.jpg"
+        files[filename] = downscaled[sha256]
+        for page_number in dict.fromkeys(image_pages[sha256]):
+            pages.setdefault(page_number, []).append(filename)
+
+    return {
+        "files": files,
+        "pages": pages,
+        "stats": {
+            "images_found": found,
+            "unique_images": len(images),
+            "repeated_dropped": len(images) - len(kept),
+            "too_small": len(kept) - len(files),
+            "images_kept": len(files),
+            "bytes_before": sum(len(images[sha256]) for sha256 in kept),
+            "bytes_after": sum(len(data) for data in files.values()),
+            "seconds": time.monotonic() - started,
+        },
+    }
+
+def _card_query(card):
+    """Card text used to find the slide a card was written from"""
+    import re
+
+    if card.get('type') == 'cloze':
+        return re.sub(r"\{\{c\d+::(.*?)(::.*?)?\}\}", r"\1", card.get('text', ''))
+    return f"{card.get('front', '')} {card.get('back', '')}"
+
+def attach_slide_images(cards, pages, slide_media, min_score=IMAGE_MATCH_MIN_SCORE, max_images=MAX_IMAGES_PER_CARD):
+    """Set card["images"] to the images of the slide each card best matches; returns how many got one
+
+    Pages ({"page", "text"} dicts) are ranked against each card with BM25.
+    A card gets the images of the best-scoring page that has any, among
+    pages scoring at least min_score and within 10% of the best match (a
+    fact repeated on a summary slide should still find its diagram).
+    """
+    from .outline import OutlineIndex
+
+    if not slide_media or not slide_media["pages"]:
+        return 0
+    index = OutlineIndex([
+        {"system": "", "category": "", "text": page["text"], "page": page["page"]}
+        for page in pages
+    ])
+    attached = 0
+    for card in cards:
+        matches = index.scored(_card_query(card), k=3)
+        for score, page in matches:
+            if score < max(min_score, 0.9 * matches[0][0]):
+                break
+            page_images = slide_media["pages"].get(page["page"])
+            if page_images:
+                card["images"] = page_images[:max_images]
+                attached += 1
+                break
+    return attached
@@ -0,0 +1,283 @@
+"""USMLE Content Outline artifact, parsing and BM25 retrieval of relevant sections"""
+import json
+import os
+
+from .settings import PROJECT_DIR, shared
+
+# Bump when the outline parser changes so existing artifacts are rebuilt
+OUTLINE_ARTIFACT_VERSION = 1
+
+# Organ systems and disciplines as titled in the USMLE Content Outline
+USMLE_SYSTEMS = [
+    "Human Development",
+    "Blood & Lymphoreticular System",
+    "Immune System",
+    "Behavioral Health",
+    "Nervous System & Special Senses",
+    "Skin & Subcutaneous Tissue",
+    "Musculoskeletal System",
+    "Cardiovascular System",
+    "Respiratory System",
+    "Gastrointestinal System",
+    "Renal & Urinary System",
+    "Pregnancy, Childbirth, & the Puerperium",
+    "Female Reproductive System & Breast",
+    "Male Reproductive System",
+    "Endocrine System",
+    "Multisystem Processes & Disorders",
+    "Biostatistics, Epidemiology/Population Health, & Interpretation of the Medical Literature",
+    "Social Sciences",
+]
+
+def _usmle_outline_paths():
+    """Paths of the outline PDF and its precompiled JSON artifact"""
+    return (
+        os.path.join(PROJECT_DIR, 'USMLE_Content_Outline.pdf'),
+        os.path.join(PROJECT_DIR, 'USMLE_Content_Outline.json'),
+    )
+
+def _is_outline_category(line):
+    """Heuristic for category headings such as 'Infectious disorders' or 'Normal processes'"""
+    import re
+
+    if not line or len(line) > 90 or line.endswith(('.', ',', ';', ':')) or not line[0].isupper():
+        return False
+    return re.search(
+        r"(disorders|processes|neoplasms|principles of therapeutics|adverse effects of drugs.*)$",
+        line,
+        re.IGNORECASE
+    ) is not None
+
+def parse_usmle_outline(outline_text):
+    """Split raw outline text into systems, each with categories and their text"""
+    normalized_systems = {name.lower(): name for name in USMLE_SYSTEMS}
+    systems = []
+    system = None
+    category = None
+
+    for raw_line in outline_text.splitlines():
+        line = " ".join(raw_line.split())
+        if not line:
+            continue
+
+        system_name = next((name for key, name in normalized_systems.items() if line.lower().startswith(key)), None)
+        if system_name and len(line) <= len(system_name) + 10:
+            system = {"name": system_name, "categories": [], "text": ""}
+            systems.append(system)
+            category = None
+            continue
+        if system is None:
+            continue
+
+        if _is_outline_category(line):
+            category = {"name": line, "text": ""}
+            system["categories"].append(category)
+        elif category is not None:
+            category["text"] += line + "\n"
+        system["text"] += line + "\n"
+
+    return systems
+
+def build_usmle_outline_artifact(pdf_path, source):
+    """Parse the outline PDF once into the structured, serializable artifact"""
+    from pypdf import PdfReader
+
+    with open(pdf_path, 'rb') as f:
+        pdf_reader = PdfReader(f)
+        outline_text = []
+        # Extract first 30 pages (covers most of the outline)
+        for page in pdf_reader.pages[:30]:
+            outline_text.append(page.extract_text())
+    text = "\n".join(outline_text)
+    return {
+        "version": OUTLINE_ARTIFACT_VERSION,
+        "source": source,
+        "text": text,
+        "systems": parse_usmle_outline(text),
+    }
+
+# Number of outline sections retrieved into each generation prompt
+OUTLINE_TOP_K = 8
+
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in into is it its of on or that the their this to was were which with
+""".split())
+
+def _index_terms(text):
+    """Lowercase word tokens used for lexical outline retrieval"""
+    import re
+
+    return [term for term in re.findall(r"[a-z0-9]+", text.lower()) if len(term) > 2 and term not in _STOPWORDS]
+
+def outline_sections(outline):
+    """Flatten an outline artifact into retrievable (system, category, text) sections"""
+    sections = []
+    for system in outline.get("systems", []):
+        if not system["categories"]:
+            sections.append({"system": system["name"], "category": "", "text": system["text"]})
+        for category in system["categories"]:
+            sections.append({"system": system["name"], "category": category["name"], "text": category["text"]})
+    return sections
+
+class OutlineIndex:
+    """Okapi BM25 index over outline sections for picking the ones relevant to a lecture"""
+
+    def __init__(self, sections, k1=1.5, b=0.75):
+        import math
+        from collections import Counter
+
+        self.sections = sections
+        self.k1 = k1
+        self.b = b
+        self._term_counts = [
+            Counter(_index_terms(f"{section['system']} {section['category']} {section['text']}"))
+            for section in sections
+        ]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+        document_frequency = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        n = len(sections)
+        self._idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def search(self, query_text, k=OUTLINE_TOP_K):
+        """Return the top-k sections for the query text, best match first"""
+        return [section for _, section in self.scored(query_text, k)]
+
+    def scored(self, query_text, k=OUTLINE_TOP_K):
+        """Return (BM25 score, section) for the top-k sections, best match first"""
+        import math
+        from collections import Counter
+
+        # Terms the lecture repeats count for more, but sub-linearly
+        query = Counter(term for term in _index_terms(query_text) if term in self._idf)
+        scores = []
+        for i, counts in enumerate(self._term_counts):
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[i] / self._avg_length) if self._avg_length else self.k1
+            score = 0.0
+            for term, query_count in query.items():
+                tf = counts.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm) * (1 + math.log(query_count))
+            if score > 0:
+                scores.append((score, i))
+        scores.sort(reverse=True)
+        return [(score, self.sections[i]) for score, i in scores[:k]]
+
+def select_outline_sections(lecture_text, k=OUTLINE_TOP_K, max_section_chars=1200):
+    """Format the outline sections most relevant to the lecture for the prompt
+
+    Falls back to the first 10,000 characters of the outline when it could
+    not be split into sections, and returns "" when no outline is available.
+    """
+    try:
+        store = get_usmle_outline_store()
+        index = store.index()
+    except Exception:
+        return ""
+    if index is None:
+        return ""
+    if not index.sections:
+        return store.get()["text"][:10000]
+
+    lines = []
+    for section in index.search(lecture_text, k):
+        heading = f"{section['system']} > {section['category']}" if section['category'] else section['system']
+        lines.append(f"{heading}:\n{section['text'][:max_section_chars].strip()}")
+    return "\n\n".join(lines)
+
+class UsmleOutlineStore:
+    """Lazily loaded outline artifact, rebuilt only when the source PDF changes
+
+    Each lookup only stats the PDF. The artifact is re-validated against the
+    source's mtime and size, falling back to its SHA-256 (so a touched but
+    unchanged file is not re-parsed), and rebuilt from the PDF otherwise.
+    """
+
+    def __init__(self, pdf_path, artifact_path):
+        import threading
+
+        self.pdf_path = pdf_path
+        self.artifact_path = artifact_path
+        self._outline = None
+        self._index = None
+        self._index_sha256 = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_sha256(path):
+        import hashlib
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _read_artifact(self):
+        try:
+            with open(self.artifact_path, encoding="utf-8") as f:
+                artifact = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return artifact if artifact.get("version") == OUTLINE_ARTIFACT_VERSION else None
+
+    def _write_artifact(self, artifact):
+        # The artifact is only an optimization; a read-only deployment still works from memory
+        try:
+            tmp_path = self.artifact_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(artifact, f)
+            os.replace(tmp_path, self.artifact_path)
+        except OSError:
+            pass
+
+    def index(self):
+        """BM25 index over the current outline's sections, built once per artifact"""
+        outline = self.get()
+        if not outline:
+            return None
+        with self._lock:
+            if self._index is None or self._index_sha256 != outline["source"]["sha256"]:
+                self._index = OutlineIndex(outline_sections(outline))
+                self._index_sha256 = outline["source"]["sha256"]
+            return self._index
+
+    def get(self):
+        """Return the outline artifact dict, or None if the outline PDF is missing"""
+        try:
+            stat = os.stat(self.pdf_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            outline = self._outline
+            if outline and outline["source"]["mtime"] == stat.st_mtime and outline["source"]["size"] == stat.st_size:
+                return outline
+
+            if outline is None:
+                outline = self._read_artifact()
+                if outline and outline["source"]["mtime"] == stat.st_mtime and outline["source"]["size"] == stat.st_size:
+                    self._outline = outline
+                    return outline
+
+            sha256 = self._file_sha256(self.pdf_path)
+            source = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256}
+            if outline and outline["source"].get("sha256") == sha256:
+                # Touched but unchanged: refresh the recorded mtime instead of re-parsing
+                outline = dict(outline, source=source)
+            else:
+                outline = build_usmle_outline_artifact(self.pdf_path, source)
+            self._write_artifact(outline)
+            self._outline = outline
+            return outline
+
+@shared
+def get_usmle_outline_store():
+    """Process-wide outline store shared by every session"""
+    return UsmleOutlineStore(*_usmle_outline_paths())
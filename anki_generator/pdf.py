@@ -0,0 +1,249 @@
+"""PDF text extraction: shared cache, parallel page extraction and background jobs"""
+import io
+import logging
+import os
+
+from .settings import get_setting, shared
+from .tokens import LECTURE_TOKEN_BUDGET, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Minimum page count before PDF extraction fans out to a process pool
+PDF_PARALLEL_MIN_PAGES = 40
+
+class PdfTextCache:
+    """Thread-safe LRU cache of PDF extraction results keyed by content hash"""
+
+    def __init__(self, max_entries=32, max_chars=20_000_000):
+        import threading
+        from collections import OrderedDict
+
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(result):
+        # full_text plus the per-page copies of the same text
+        return 2 * len(result.get("full_text", ""))
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        size = self._size(result)
+        if size > self.max_chars:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._chars -= self._size(self._entries.pop(key))
+            self._entries[key] = result
+            self._chars += size
+            # Evict least recently used entries until we are back under both limits
+            while self._entries and (len(self._entries) > self.max_entries or self._chars > self.max_chars):
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= self._size(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "chars": self._chars,
+            }
+
+@shared
+def get_pdf_text_cache():
+    """Process-wide extraction cache shared by every session"""
+    return PdfTextCache(
+        max_entries=int(get_setting("PDF_CACHE_MAX_ENTRIES", 32)),
+        max_chars=int(get_setting("PDF_CACHE_MAX_CHARS", 20_000_000)),
+    )
+
+def _pdf_metadata(pdf_reader):
+    """Title, author and page count for an open PdfReader"""
+    return {
+        "title": pdf_reader.metadata.title if pdf_reader.metadata and pdf_reader.metadata.title else "Unknown",
+        "author": pdf_reader.metadata.author if pdf_reader.metadata and pdf_reader.metadata.author else "Unknown",
+        "page_count": len(pdf_reader.pages)
+    }
+
+def iter_pdf_pages(pdf_bytes, pdf_reader=None, workers=None, min_parallel_pages=None):
+    """Yield {"page", "text"} dicts in page order as soon as each page is extracted
+
+    Documents with at least min_parallel_pages pages are split into page
+    ranges and extracted by a pool of `workers` processes (defaults to the
+    CPU count; 1 disables the pool), each opening its own PdfReader. Either
+    argument left as None comes from the PDF_EXTRACT_WORKERS and
+    PDF_PARALLEL_MIN_PAGES settings. If the pool cannot be used, extraction
+    continues serially from the first page that has not been yielded yet.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from pypdf import PdfReader
+
+    from . import pdf_worker
+
+    if pdf_reader is None:
+        pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+    if workers is None:
+        workers = int(get_setting("PDF_EXTRACT_WORKERS") or os.cpu_count() or 1)
+    if min_parallel_pages is None:
+        min_parallel_pages = int(get_setting("PDF_PARALLEL_MIN_PAGES", PDF_PARALLEL_MIN_PAGES))
+    page_count = len(pdf_reader.pages)
+    next_page = 0
+
+    if workers > 1 and page_count >= min_parallel_pages:
+        ranges = pdf_worker.shard_page_ranges(page_count, workers)
+        # Forking a multi-threaded process (the Streamlit server) can deadlock on locks other threads hold
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        try:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(ranges)),
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=pdf_worker.init_worker,
+                initargs=(pdf_bytes,)
+            ) as executor:
+                futures = [executor.submit(pdf_worker.extract_page_range, start, stop) for start, stop in ranges]
+                # Wait on shards in submission order so pages come out in order
+                for future in futures:
+                    for text in future.result():
+                        next_page += 1
+                        yield {"page": next_page, "text": text}
+        except (OSError, RuntimeError):
+            # BrokenProcessPool is a RuntimeError subclass
+            pass
+
+    for page_num in range(next_page, page_count):
+        yield {"page": page_num + 1, "text": pdf_reader.pages[page_num].extract_text()}
+
+def _assemble_pdf_result(page_texts, metadata):
+    """Build the {"full_text", "pages", "metadata"} extraction result"""
+    return {
+        "full_text": "\n\n".join(page["text"] for page in page_texts),
+        "pages": page_texts,
+        "metadata": metadata
+    }
+
+def extract_pdf_text(pdf_file, workers=None, min_parallel_pages=None):
+    """Extract text from uploaded PDF file using pypdf
+
+    Results are cached by the SHA-256 of the file bytes, so reruns with an
+    unchanged upload skip parsing entirely. Cached results are shared across
+    sessions and must be treated as read-only.
+    """
+    try:
+        import hashlib
+        from pypdf import PdfReader
+
+        # Read PDF from uploaded file
+        pdf_bytes = pdf_file.getvalue() if hasattr(pdf_file, "getvalue") else pdf_file.read()
+        cache_key = hashlib.sha256(pdf_bytes).hexdigest()
+        cache = get_pdf_text_cache()
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+        metadata = _pdf_metadata(pdf_reader)
+        page_texts = list(iter_pdf_pages(pdf_bytes, pdf_reader, workers, min_parallel_pages))
+
+        result = _assemble_pdf_result(page_texts, metadata)
+        cache.put(cache_key, result)
+        return result
+    except Exception as e:
+        logger.error("Error extracting PDF text: %s", e)
+        return None
+
+class PdfExtractionJob:
+    """Background extraction of one PDF that exposes pages as they arrive
+
+    The Streamlit script polls the job on each rerun: pages, progress and
+    the text extracted so far are readable while the worker thread is still
+    running, and the finished result is stored in the shared text cache.
+    """
+
+    def __init__(self, pdf_bytes, cache_key, cache, workers=None, min_parallel_pages=None):
+        import threading
+
+        self.cache_key = cache_key
+        self.pages = []
+        self.chars = 0
+        self.tokens = 0
+        self.metadata = None
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(pdf_bytes, cache, workers, min_parallel_pages),
+            daemon=True
+        )
+
+    def start(self):
+        import time
+
+        self.started_at = time.monotonic()
+        self._thread.start()
+        return self
+
+    def _run(self, pdf_bytes, cache, workers, min_parallel_pages):
+        import time
+        from pypdf import PdfReader
+
+        try:
+            pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+            self.metadata = _pdf_metadata(pdf_reader)
+            for page in iter_pdf_pages(pdf_bytes, pdf_reader, workers, min_parallel_pages):
+                page_tokens = estimate_tokens(page["text"])
+                with self._lock:
+                    self.pages.append(page)
+                    self.chars += len(page["text"]) + 2
+                    self.tokens += page_tokens
+            self.result = _assemble_pdf_result(list(self.pages), self.metadata)
+            cache.put(self.cache_key, self.result)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.finished_at = time.monotonic()
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    @property
+    def pages_done(self):
+        return len(self.pages)
+
+    @property
+    def pages_per_second(self):
+        import time
+
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return self.pages_done / elapsed if elapsed > 0 else 0.0
+
+    def text_so_far(self):
+        with self._lock:
+            return "\n\n".join(page["text"] for page in self.pages)
+
+    def pages_so_far(self):
+        with self._lock:
+            return list(self.pages)
+
+    def prompt_ready(self, token_budget=LECTURE_TOKEN_BUDGET):
+        """True once enough text for the generation prompt has been extracted"""
+        return self.done or self.tokens >= token_budget
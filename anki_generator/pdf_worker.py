@@ -0,0 +1,37 @@
+"""Process-pool workers for parallel PDF text extraction.
+
+The pool pickles these functions by module and name, so they live at the top
+of an importable module. Importing it still runs anki_generator/__init__.py,
+so a worker started with spawn or forkserver loads the rest of the package
+once at startup; the functions themselves only need pypdf.
+"""
+import io
+
+from pypdf import PdfReader
+
+# Each worker process opens its own reader once and reuses it for every shard
+_reader = None
+
+
+def init_worker(pdf_bytes):
+    """Open a PdfReader on the shared PDF bytes in this worker process"""
+    global _reader
+    _reader = PdfReader(io.BytesIO(pdf_bytes))
+
+
+def extract_page_range(start, stop):
+    """Extract text for pages [start, stop) using this worker's reader"""
+    return [_reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def shard_page_ranges(page_count, workers, shards_per_worker=2):
+    """Split page indices into contiguous (start, stop) ranges in page order"""
+    shard_count = max(1, min(page_count, workers * shards_per_worker))
+    size, extra = divmod(page_count, shard_count)
+    ranges = []
+    start = 0
+    for i in range(shard_count):
+        stop = start + size + (1 if i < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
@@ -0,0 +1,133 @@
+"""System and per-lecture prompts for card generation"""
+from .outline import USMLE_SYSTEMS, get_usmle_outline_store, select_outline_sections
+from .tokens import estimate_tokens
+
+# Shortest prefix Anthropic will cache on Sonnet and Opus; a shorter system prompt is sent uncached
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# Static instructions sent as the cacheable system prompt; identical for every request
+CARD_INSTRUCTIONS = """You are an expert medical educator creating ANKI flashcards for USMLE STEP 1 preparation.
+
+You will be given medical lecture content and asked to generate a number of high-quality flashcard proposals.
+
+INSTRUCTIONS:
+1. Focus on high-yield concepts likely to appear on STEP 1
+2. Create a mix of card types:
+   - Basic cards (question → answer)
+   - Clinical vignette cards (case presentation → diagnosis/mechanism)
+   - Cloze deletion cards (fill-in-the-blank)
+3. Each card should test ONE specific concept
+4. Use clear, unambiguous questions
+5. Keep answers concise (1-3 sentences max)
+6. Include clinical context when possible
+7. For each card, determine:
+   - The primary organ system (e.g., "Nervous System & Special Senses", "Cardiovascular System", "Multisystem Processes")
+   - The USMLE category from the Content Outline (e.g., "Infectious disorders", "Neoplasms", "Degenerative disorders")
+
+# CONTENT SELECTION STRATEGY
+
+## PRIORITIZE (High-Yield):
+- Mechanisms of disease and pathophysiology
+- Classic presentations and buzzwords
+- First-line treatments and interventions
+- Diagnostic criteria and lab findings
+- Embryology and anatomy with clinical correlations
+- Pharmacology (mechanism, side effects, contraindications)
+- Epidemiology (most common, risk factors)
+- Comparisons and differentials ("X vs Y")
+- Content that appears in multiple contexts
+- Information emphasized by the lecturer (repeated, bolded, "important")
+
+## AVOID (Low-Yield):
+- Administrative information (dates, schedules, grading)
+- Overly detailed minutiae not clinically relevant
+- Purely historical information without clinical application
+- Instructor opinions without evidence basis
+
+OUTPUT FORMAT:
+Return ONLY a valid JSON array with this exact structure (no markdown, no explanations):
+
+[
+  {
+    "type": "basic",
+    "front": "What is the question?",
+    "back": "This is the answer.",
+    "source": "<lecture source given in the request>",
+    "organ_system": "Nervous System & Special Senses",
+    "usmle_category": "Infectious disorders"
+  },
+  {
+    "type": "cloze",
+    "text": "The {{c1::answer}} is hidden in this sentence.",
+    "source": "<lecture source given in the request>",
+    "organ_system": "Nervous System & Special Senses",
+    "usmle_category": "Degenerative disorders"
+  }
+]
+
+IMPORTANT: 
+- Return ONLY the JSON array, nothing else
+- Use double curly braces {{c1::text}} for cloze deletions
+- Ensure all JSON is valid (proper escaping of quotes, etc.)
+- Generate exactly the number of cards requested
+- Always include organ_system and usmle_category fields
+- Use the exact organ system names from the USMLE Content Outline
+- Be specific with USMLE categories (not just "disorders" but the specific type)"""
+
+def outline_category_map():
+    """Compact 'System: category; category' listing of the whole outline, or "" if unavailable"""
+    try:
+        outline = get_usmle_outline_store().get()
+    except Exception:
+        return ""
+    if not outline or not outline.get("systems"):
+        return ""
+    return "\n".join(
+        f"- {system['name']}: " + "; ".join(category["name"] for category in system["categories"])
+        for system in outline["systems"]
+    )
+
+def build_system_prompt():
+    """Static system prompt blocks, marked for Anthropic prompt caching
+
+    Everything here is identical across lectures and students so the
+    prefix is written to the cache once and read back by later requests.
+    """
+    text = CARD_INSTRUCTIONS + "\n\nUSMLE ORGAN SYSTEMS: " + "; ".join(USMLE_SYSTEMS)
+    category_map = outline_category_map()
+    if category_map:
+        text += "\n\nUSMLE CONTENT OUTLINE (systems and categories):\n" + category_map
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+def system_prompt_cacheable():
+    """True if the system prompt is long enough to be cached
+
+    The instructions alone fall short of PROMPT_CACHE_MIN_TOKENS; caching
+    starts once the USMLE outline's category map is part of the prompt.
+    """
+    return estimate_tokens(build_system_prompt()[0]["text"]) >= PROMPT_CACHE_MIN_TOKENS
+
+def build_lecture_prompt(pdf_content, num_cards, lecture_title="", custom_guidance="", existing_cards=None):
+    """Per-lecture user message: the lecture text, relevant outline sections and request details
+
+    existing_cards, if given, are listed so a follow-up request does not repeat them.
+    """
+    usmle_content = select_outline_sections(pdf_content)
+    source = lecture_title if lecture_title else 'Medical Lecture'
+    existing = ""
+    if existing_cards:
+        existing = "These cards already exist, so do not repeat them:\n" + "\n".join(
+            f"- {card.get('front') or card.get('text', '')}" for card in existing_cards
+        ) + "\n\n"
+
+    return f"""Analyze the following medical lecture content and generate {num_cards} high-quality flashcard proposals.
+
+LECTURE CONTENT:
+{pdf_content}
+
+{"RELEVANT USMLE CONTENT OUTLINE SECTIONS (for categorization):" if usmle_content else ""}
+{usmle_content}
+
+Use "{source}" as the "source" of every card.
+
+{"## CUSTOM INSTRUCTIONS FROM USER:" + chr(10) + custom_guidance + chr(10) if custom_guidance else ""}{existing}Generate exactly {num_cards} flashcards now:"""
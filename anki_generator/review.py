@@ -0,0 +1,71 @@
+"""Precomputed index over a deck for paginated, filtered review"""
+import re
+
+# Card fields the review list can be filtered by
+REVIEW_FACETS = ("type", "organ_system", "usmle_category")
+
+_CLOZE = re.compile(r'\{\{c\d+::(.*?)\}\}')
+
+def _facet_value(card, facet):
+    if facet == "type":
+        return str(card.get("type", "basic")).lower()
+    return card.get(facet) or ""
+
+def card_display(card):
+    """Text shown for a card in review, computed once per card rather than on every rerun"""
+    if card.get("type") == "cloze":
+        cloze_text = card.get("text", "")
+        return {
+            # Show the text with the answer highlighted
+            "text": _CLOZE.sub(r'**[\1]**', cloze_text),
+            "answers": _CLOZE.findall(cloze_text),
+        }
+    return {"front": card.get("front", ""), "back": card.get("back", "")}
+
+class ReviewIndex:
+    """Facet postings and display text for a deck, built once per deck change
+
+    Built from a CardStore (or any iterable of CardRecords). Filtering
+    intersects the posting lists of the chosen facet values, so a rerun only
+    touches the matching cards and the ones on the visible page, not the
+    whole deck.
+    """
+
+    def __init__(self, records):
+        self._cards = {}
+        self._display = {}
+        # card ID -> position in deck order
+        self.positions = {}
+        # facet -> value -> card IDs in deck order
+        self.postings = {facet: {} for facet in REVIEW_FACETS}
+        for position, record in enumerate(records):
+            self._cards[record.id] = record.card
+            self.positions[record.id] = position
+            for facet in REVIEW_FACETS:
+                self.postings[facet].setdefault(_facet_value(record.card, facet), []).append(record.id)
+
+    def options(self, facet):
+        """Values of a facet with their card counts, most common first"""
+        return sorted(
+            ((value, len(card_ids)) for value, card_ids in self.postings[facet].items()),
+            key=lambda item: (-item[1], item[0])
+        )
+
+    def filter(self, selected):
+        """IDs of cards matching every facet in `selected` (facet -> chosen values), in deck order"""
+        matches = None
+        for facet, values in selected.items():
+            if not values:
+                continue
+            card_ids = set()
+            for value in values:
+                card_ids.update(self.postings[facet].get(value, ()))
+            matches = card_ids if matches is None else matches & card_ids
+        if matches is None:
+            return list(self.positions)
+        return sorted(matches, key=self.positions.__getitem__)
+
+    def display(self, card_id):
+        if card_id not in self._display:
+            self._display[card_id] = card_display(self._cards[card_id])
+        return self._display[card_id]
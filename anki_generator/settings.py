@@ -0,0 +1,49 @@
+"""Runtime settings and process-wide singletons shared by the web app and the CLI
+
+Settings are read from values passed to configure() (the Streamlit app
+passes its secrets) and otherwise from environment variables of the same
+name, so the library never needs Streamlit to be importable.
+"""
+import functools
+import os
+import threading
+from pathlib import Path
+
+# Repository root: default home of the outline artifacts and the on-disk caches
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+_overrides = {}
+
+
+def configure(values):
+    """Override settings (e.g. with st.secrets); later calls update earlier ones"""
+    _overrides.update(values)
+
+
+def get_setting(name, default=None):
+    """Configured value for name, else the environment variable, else default"""
+    if name in _overrides:
+        return _overrides[name]
+    return os.environ.get(name, default)
+
+
+def shared(factory):
+    """Build factory() once per process on first use and return the same instance afterwards
+
+    The library counterpart of st.cache_resource: caches, limiters and
+    client pools are shared by every caller (and every Streamlit session)
+    in the process.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    get.clear = instance.clear
+    return get
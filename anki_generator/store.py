@@ -0,0 +1,75 @@
+"""Deck of generated cards with stable IDs and per-card selection"""
+
+class CardRecord:
+    """One card in a deck: its stable ID, the card dict and whether it is selected for export"""
+
+    __slots__ = ("id", "card", "selected")
+
+    def __init__(self, card_id, card, selected=True):
+        self.id = card_id
+        self.card = card
+        self.selected = selected
+
+class CardStore:
+    """Insertion-ordered cards keyed by IDs that never change or get reused
+
+    Adding, removing and (de)selecting a card are O(1); the selected count
+    is kept up to date as cards change instead of being recounted. version
+    increases on every add and remove so indexes built over the deck know
+    when to rebuild; selection_version increases whenever a card is
+    selected or deselected.
+    """
+
+    def __init__(self, cards=()):
+        self._records = {}
+        self._next_id = 1
+        self.selected_count = 0
+        self.version = 0
+        self.selection_version = 0
+        for card in cards:
+            self.add(card)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def __contains__(self, card_id):
+        return card_id in self._records
+
+    def get(self, card_id):
+        return self._records[card_id]
+
+    def add(self, card, selected=True):
+        """Append a card and return its new ID"""
+        card_id = self._next_id
+        self._next_id += 1
+        self._records[card_id] = CardRecord(card_id, card, selected)
+        self.selected_count += selected
+        self.version += 1
+        return card_id
+
+    def remove(self, card_id):
+        """Remove a card and return its record"""
+        record = self._records.pop(card_id)
+        self.selected_count -= record.selected
+        self.version += 1
+        return record
+
+    def set_selected(self, card_ids, selected):
+        """Select or deselect the given cards"""
+        for card_id in card_ids:
+            record = self._records[card_id]
+            if record.selected != selected:
+                record.selected = selected
+                self.selected_count += 1 if selected else -1
+                self.selection_version += 1
+
+    def cards(self):
+        """All card dicts in deck order"""
+        return [record.card for record in self._records.values()]
+
+    def selected_cards(self):
+        """Card dicts selected for export, in deck order"""
+        return [record.card for record in self._records.values() if record.selected]
@@ -0,0 +1,139 @@
+"""Local token estimation, per-model token telemetry and prompt budgeting"""
+import json
+import re
+
+from .settings import shared
+
+# Estimated tokens of lecture text sent to the LLM in a single generation request (~15,000 characters of prose)
+LECTURE_TOKEN_BUDGET = 4000
+
+# Word, number and symbol pieces used by the local token estimator
+_TOKEN_PIECES = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+
+def _piece_tokens(piece):
+    """Estimated tokens for one word, number or symbol piece"""
+    if piece[0].isdigit():
+        return (len(piece) + 2) // 3
+    if piece[0].isalpha():
+        # Common short words are one token; long (e.g. medical) terms split into several
+        return 1 + (len(piece) - 1) // 6
+    return 1
+
+def estimate_tokens(text):
+    """Local token estimate for a prompt, without calling the API"""
+    return sum(_piece_tokens(piece) for piece in _TOKEN_PIECES.findall(text))
+
+def _token_cut(text, token_limit):
+    """Index at which text exceeds token_limit estimated tokens (len(text) if it never does)"""
+    tokens = 0
+    for match in _TOKEN_PIECES.finditer(text):
+        tokens += _piece_tokens(match.group())
+        if tokens > token_limit:
+            return match.start()
+    return len(text)
+
+def split_by_tokens(text, token_budget):
+    """Split text into consecutive pieces of at most token_budget estimated tokens"""
+    pieces = []
+    while text:
+        cut = _token_cut(text, token_budget) or len(text)
+        pieces.append(text[:cut])
+        text = text[cut:]
+    return pieces
+
+# Output token ceiling when sizing max_tokens from telemetry
+MAX_OUTPUT_TOKENS = 32000
+
+# Observed per-card samples needed before telemetry replaces the default max_tokens guess
+TELEMETRY_MIN_SAMPLES = 20
+
+class TokenTelemetry:
+    """Observed token usage per model and card type, used to size requests adaptively
+
+    Keeps a rolling window of output tokens per card for each (model, card
+    type) and a running ratio of actual to locally estimated input tokens
+    for each model.
+    """
+
+    def __init__(self, window=200):
+        import threading
+        from collections import defaultdict, deque
+
+        self._per_card = defaultdict(lambda: deque(maxlen=window))
+        self._input_ratio = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, estimated_input_tokens, usage, cards):
+        actual_input = usage["input_tokens"] + usage["cache_read_input_tokens"] + usage["cache_creation_input_tokens"]
+        # Attribute the response's output tokens to its cards by their size
+        sizes = [estimate_tokens(json.dumps(card)) for card in cards]
+        total_size = sum(sizes)
+        with self._lock:
+            if estimated_input_tokens and actual_input:
+                ratio = actual_input / estimated_input_tokens
+                previous = self._input_ratio.get(model)
+                self._input_ratio[model] = ratio if previous is None else 0.8 * previous + 0.2 * ratio
+            if total_size:
+                for card, size in zip(cards, sizes):
+                    card_type = str(card.get('type', 'basic')).lower()
+                    self._per_card[(model, card_type)].append(usage["output_tokens"] * size / total_size)
+
+    def input_ratio(self, model):
+        """Actual / estimated input tokens for this model (1.0 until observed)"""
+        with self._lock:
+            return self._input_ratio.get(model, 1.0)
+
+    def output_tokens_per_card(self, model, quantile=0.9):
+        """High quantile of observed output tokens per card, or None without enough samples"""
+        with self._lock:
+            samples = sorted(
+                value for (sample_model, _), values in self._per_card.items() if sample_model == model
+                for value in values
+            )
+        if len(samples) < TELEMETRY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def summary(self):
+        """Rows of per model and card type averages for display"""
+        with self._lock:
+            return [
+                {
+                    "model": model,
+                    "type": card_type,
+                    "cards": len(values),
+                    "avg_tokens_per_card": sum(values) / len(values),
+                    "input_ratio": self._input_ratio.get(model, 1.0),
+                }
+                for (model, card_type), values in sorted(self._per_card.items())
+                if values
+            ]
+
+@shared
+def get_token_telemetry():
+    """Process-wide token telemetry shared by every session"""
+    return TokenTelemetry()
+
+def size_max_tokens(model, num_cards):
+    """max_tokens for a request of num_cards, from observed output per card when available"""
+    per_card = get_token_telemetry().output_tokens_per_card(model)
+    if per_card is None:
+        # ~250 tokens per card + buffer until there is telemetry for this model
+        return max(4000, num_cards * 250 + 1000)
+    return min(MAX_OUTPUT_TOKENS, max(1000, int(num_cards * per_card * 1.2) + 300))
+
+def calibrated_budget(model=None, token_budget=LECTURE_TOKEN_BUDGET):
+    """token_budget in local estimate units, scaled by the actual/estimated input ratio observed for the model"""
+    ratio = get_token_telemetry().input_ratio(model) if model else 1.0
+    return token_budget / ratio
+
+def lecture_excerpt(pdf_text, model=None, token_budget=LECTURE_TOKEN_BUDGET):
+    """Longest prefix of the lecture that fits the input token budget
+
+    The local estimate is scaled by the actual/estimated ratio observed for
+    the model, so dense text is not cut short and verbose text is not sent
+    over budget.
+    """
+    if not pdf_text:
+        return ""
+    return pdf_text[:_token_cut(pdf_text, calibrated_budget(model, token_budget))]
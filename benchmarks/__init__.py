@@ -0,0 +1 @@
+"""Offline benchmarks for the extraction, generation and export hot paths (python -m benchmarks)"""
@@ -0,0 +1,6 @@
+"""python -m benchmarks"""
+import sys
+
+from .run import main
+
+sys.exit(main())
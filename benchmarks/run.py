@@ -0,0 +1,248 @@
+"""Benchmark runner: each case runs in a fresh process and is compared against a saved baseline
+
+    python -m benchmarks                      # run every case, compare with benchmarks/baseline.json
+    python -m benchmarks --save-baseline      # run and record the results as the new baseline
+    python -m benchmarks --filter export --quick
+
+Cases cover PDF text extraction (10/100/1,000 synthetic pages), prompt
+assembly and response parsing in generate_cards_with_claude against a
+stubbed client (50/1k/10k cards), and .apkg export in memory and to disk
+(50/1k/10k cards). Each case records the median wall time, the process's
+peak RSS and the tracemalloc peak of one extra run. Nothing touches the
+network. Baselines are machine-specific: save one on the machine you
+compare on.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .synthetic import StubClient, StubClientPool, make_cards, make_lecture_pdf
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+# A metric regresses when it exceeds the baseline by this fraction and by more than its noise floor
+DEFAULT_THRESHOLD = 0.25
+NOISE_FLOORS = {"wall_seconds": 0.005, "peak_rss_mb": 2.0, "alloc_peak_mb": 0.5}
+BENCHMARK_MODEL = "claude-sonnet-4-5-20250929"
+
+PDF_PAGES = (10, 100, 1000)
+CARD_COUNTS = (50, 1000, 10000)
+
+
+def _extract_case(page_count, work_dir):
+    import io
+
+    from anki_generator.pdf import extract_pdf_text
+
+    pdf_bytes = make_lecture_pdf(page_count)
+
+    def run():
+        result = extract_pdf_text(io.BytesIO(pdf_bytes))
+        if not result or len(result["pages"]) != page_count:
+            raise RuntimeError("extraction failed")
+    return run
+
+
+def _generate_case(card_count, work_dir):
+    import io
+
+    from anki_generator import generation
+    from anki_generator.pdf import extract_pdf_text
+
+    pdf_text = extract_pdf_text(io.BytesIO(make_lecture_pdf(40)))["full_text"]
+    # Every request goes to the stub, so only prompt assembly, parsing and bookkeeping are timed
+    generation.get_client_pool = lambda: StubClientPool(StubClient(card_count))
+
+    def run():
+        cards, error = generation.generate_cards_with_claude(
+            pdf_text, card_count, "sk-ant-benchmark", BENCHMARK_MODEL, "Synthetic Lecture",
+            force_regenerate=True
+        )
+        if error or len(cards) != card_count:
+            raise RuntimeError(error or f"expected {card_count} cards, got {len(cards)}")
+    return run
+
+
+def _export_case(card_count, to_disk, work_dir):
+    from anki_generator.export import export_apkg_file, generate_apkg_file
+
+    cards = make_cards(card_count)
+    output_path = os.path.join(work_dir, "deck.apkg")
+
+    def run():
+        if to_disk:
+            _, error = export_apkg_file(cards, "Benchmark Deck", output_path)
+        else:
+            _, error = generate_apkg_file(cards, "Benchmark Deck")
+        if error:
+            raise RuntimeError(error)
+    return run
+
+
+def _cases():
+    """name -> (factory(work_dir) returning the function to time, timed repeats)"""
+    cases = {}
+    for pages in PDF_PAGES:
+        cases[f"extract_pdf_text/{pages}_pages"] = (
+            lambda work_dir, pages=pages: _extract_case(pages, work_dir), 5 if pages < 1000 else 3
+        )
+    for count in CARD_COUNTS:
+        repeats = 5 if count < 10000 else 3
+        cases[f"generate_cards_with_claude/{count}_cards"] = (
+            lambda work_dir, count=count: _generate_case(count, work_dir), repeats
+        )
+        cases[f"generate_apkg_file/{count}_cards"] = (
+            lambda work_dir, count=count: _export_case(count, False, work_dir), repeats
+        )
+        cases[f"export_apkg_file/{count}_cards"] = (
+            lambda work_dir, count=count: _export_case(count, True, work_dir), repeats
+        )
+    return cases
+
+
+def _peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def measure_case(name, repeats=None):
+    """Run one case in this process and return its metrics"""
+    import gc
+    import tracemalloc
+
+    from anki_generator.settings import configure
+
+    with tempfile.TemporaryDirectory(prefix="anki-benchmark-") as work_dir:
+        configure({
+            # Every run does the full work: no response cache hits, no PDF text cache, no rate limiting
+            "RESPONSE_CACHE_PATH": os.path.join(work_dir, "responses.sqlite"),
+            "PDF_CACHE_MAX_CHARS": 0,
+            "ANTHROPIC_REQUESTS_PER_MINUTE": 10 ** 9,
+            "ANTHROPIC_TOKENS_PER_MINUTE": 10 ** 12,
+        })
+        factory, default_repeats = _cases()[name]
+        run = factory(work_dir)
+        # Warm-up: imports and process-wide singletons are not part of the measurement
+        run()
+
+        times = []
+        for _ in range(repeats or default_repeats):
+            gc.collect()
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+
+        gc.collect()
+        tracemalloc.start()
+        run()
+        _, alloc_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "wall_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "peak_rss_mb": _peak_rss_mb(),
+        "alloc_peak_mb": alloc_peak / 1e6,
+    }
+
+
+def _run_isolated(name, repeats):
+    """Metrics for one case from a fresh interpreter, so peak RSS is that case's own"""
+    command = [sys.executable, "-m", "benchmarks", "--case", name]
+    if repeats:
+        command += ["--repeats", str(repeats)]
+    completed = subprocess.run(command, cwd=REPO_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{completed.stderr.strip()}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold):
+    """(name, metric, baseline value, new value) for every metric that regressed past threshold"""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, floor in NOISE_FLOORS.items():
+            if metric in base and metrics[metric] > base[metric] * (1 + threshold) and metrics[metric] - base[metric] > floor:
+                regressions.append((name, metric, base[metric], metrics[metric]))
+    return regressions
+
+
+def _change(value, base):
+    return f"{(value - base) / base:+.0%}" if base else "n/a"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks", description="Benchmark the extraction, generation and export hot paths")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--quick", action="store_true", help="skip the 1,000-page and 10k-card cases")
+    parser.add_argument("--repeats", type=int, help="timed runs per case (default: 5, or 3 for the largest sizes)")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="baseline JSON (default: benchmarks/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fail when a metric exceeds its baseline by more than this fraction (default: 0.25)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        # Child process: measure one case and report it as a JSON line
+        print(json.dumps(measure_case(args.case, args.repeats)))
+        return 0
+
+    names = [
+        name for name in _cases()
+        if args.filter in name and not (args.quick and name.endswith(("/1000_pages", "/10000_cards")))
+    ]
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+    baseline_results = baseline.get("results", {})
+
+    results = {}
+    print(f"{'case':42} {'wall':>10} {'peak RSS':>10} {'alloc peak':>11}  vs baseline (wall / RSS / alloc)")
+    for name in names:
+        try:
+            metrics = _run_isolated(name, args.repeats)
+        except RuntimeError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+        results[name] = metrics
+        base = baseline_results.get(name)
+        versus = " / ".join(_change(metrics[metric], base[metric]) for metric in NOISE_FLOORS) if base else "-"
+        print(
+            f"{name:42} {metrics['wall_seconds'] * 1000:8.1f}ms {metrics['peak_rss_mb']:8.1f}MB "
+            f"{metrics['alloc_peak_mb']:9.1f}MB  {versus}"
+        )
+
+    if args.save_baseline:
+        # Cases left out by --filter/--quick keep their previous baseline
+        baseline_path.write_text(json.dumps({
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "saved": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": {**baseline_results, **results},
+        }, indent=2) + "\n", encoding="utf-8")
+        print(f"saved baseline to {baseline_path}")
+        return 0
+
+    if not baseline_results:
+        print(f"no baseline at {baseline_path}; run with --save-baseline to record one")
+        return 0
+    regressions = compare(results, baseline_results, args.threshold)
+    for name, metric, base, value in regressions:
+        print(f"REGRESSION {name} {metric}: {base:.4g} -> {value:.4g} ({_change(value, base)})")
+    if regressions:
+        return 1
+    print(f"no regressions beyond {args.threshold:.0%}")
+    return 0
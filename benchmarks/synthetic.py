@@ -0,0 +1,102 @@
+"""Synthetic lectures, canned model responses and an offline stand-in for the Anthropic client"""
+import json
+import types
+
+_TOPICS = [
+    "mitral valve regurgitation causes a holosystolic murmur at the apex",
+    "aortic stenosis causes a crescendo-decrescendo systolic ejection murmur",
+    "nephrotic syndrome presents with proteinuria, edema and hyperlipidemia",
+    "hepatitis B surface antigen is the first serologic marker of infection",
+    "myasthenia gravis is caused by acetylcholine receptor antibodies",
+    "thyroid storm is treated with propranolol, methimazole and steroids",
+    "sickle cell anemia results from a glutamate to valine substitution",
+    "gout shows negatively birefringent monosodium urate crystals",
+]
+
+_ORGAN_SYSTEMS = ["Cardiovascular System", "Renal & Urinary System", "Nervous System & Special Senses", "Blood & Lymphoreticular System"]
+_CATEGORIES = ["Pathology", "Pharmacology", "Physiology", "Microbiology"]
+
+
+def make_lecture_pdf(page_count, lines_per_page=24):
+    """Bytes of a text-only lecture PDF with a repeated header/footer and varied slide content"""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")
+    kids = []
+    for page in range(page_count):
+        lines = ["MED 101 Integrated Cardiorenal Physiology", f"Slide {page + 1}"]
+        lines += [
+            f"{i + 1}. {_TOPICS[(page + i) % len(_TOPICS)]} (case {page * lines_per_page + i})"
+            for i in range(lines_per_page)
+        ]
+        lines.append("Copyright Geisel School of Medicine - for educational use only")
+        content = ("BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET").encode()
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content_id, font)
+        ))
+    objects[pages_id - 1] = (
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % kid for kid in kids) + b"] /Count %d >>" % page_count
+    )
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def make_cards(count):
+    """Card dicts shaped like the model's output: three basic cards to every cloze card"""
+    cards = []
+    for i in range(count):
+        topic = _TOPICS[i % len(_TOPICS)]
+        card = {
+            "source": "Synthetic Lecture",
+            "organ_system": _ORGAN_SYSTEMS[i % len(_ORGAN_SYSTEMS)],
+            "usmle_category": _CATEGORIES[(i // len(_ORGAN_SYSTEMS)) % len(_CATEGORIES)],
+        }
+        if i % 4 == 3:
+            subject, _, rest = topic.partition(" ")
+            card.update(type="cloze", text=f"{{{{c1::{subject.capitalize()}}}}} {rest} (variant {i})")
+        else:
+            card.update(type="basic", front=f"Which finding fits this case {i}?", back=f"{topic.capitalize()}.")
+        cards.append(card)
+    return cards
+
+
+class StubClient:
+    """Answers messages.create with canned cards JSON, without any network access"""
+
+    def __init__(self, card_count):
+        text = json.dumps(make_cards(card_count), indent=2)
+        usage = types.SimpleNamespace(
+            input_tokens=4000, output_tokens=120 * card_count, cache_creation_input_tokens=0, cache_read_input_tokens=0
+        )
+        self._message = types.SimpleNamespace(
+            content=[types.SimpleNamespace(text=text)], usage=usage, stop_reason="end_turn"
+        )
+        self.messages = types.SimpleNamespace(create=lambda **kwargs: self._message)
+
+
+class StubClientPool:
+    """Stands in for the API client pool so every request goes to one StubClient"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, api_key):
+        return self._client
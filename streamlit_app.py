@@ -1,8 +1,29 @@
 import streamlit as st
-import json
-from pypdf import PdfReader
-import io
+import os
+import time
 import base64
+import html
+import re
+import secrets
+import shutil
+import weakref
+from pathlib import Path
+from urllib.parse import quote
+
+from anki_generator import (
+    BATCH_API_CONCURRENCY, BATCH_EXTRACT_CONCURRENCY, GENERATION_MAX_CONCURRENCY, LECTURE_TOKEN_BUDGET,
+    PROMPT_CACHE_MIN_TOKENS, REVIEW_FACETS, CardStore, NearDuplicateIndex, PdfExtractionJob, ReviewIndex,
+    attach_slide_images, batch_results_zip, compact_extraction, compact_pages, configure, export_apkg_file, generate_apkg_file, generate_cards_chunked,
+    generate_cards_with_claude, get_client_pool, get_pdf_text_cache, get_rate_limiter, get_token_telemetry,
+    extract_slide_media, get_usage_stats, lecture_excerpt, plan_export, run_batch_generation, stream_cards_with_claude,
+    system_prompt_cacheable,
+)
+
+# Caches, rate limits and the API client pool in anki_generator are configured from the app's secrets
+try:
+    configure(st.secrets.to_dict())
+except FileNotFoundError:
+    pass
 
 # Page configuration
 st.set_page_config(
@@ -303,584 +324,107 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'flashcards' not in st.session_state:
-    st.session_state.flashcards = []
+if 'card_store' not in st.session_state:
+    # Generated cards with stable IDs and their export selection
+    st.session_state.card_store = CardStore()
 if 'pdf_text' not in st.session_state:
     st.session_state.pdf_text = ""
 if 'pdf_metadata' not in st.session_state:
     st.session_state.pdf_metadata = {}
-if 'card_selection' not in st.session_state:
-    st.session_state.card_selection = {}
+if 'pdf_pages' not in st.session_state:
+    st.session_state.pdf_pages = []
+if 'export_manifests' not in st.session_state:
+    # Deck name -> {note GUID: content hash} of the notes already exported to that deck
+    st.session_state.export_manifests = {}
+if 'export_manifest_version' not in st.session_state:
+    # Bumped on every manifest write, so values derived from a manifest know when to recompute
+    st.session_state.export_manifest_version = 0
+if 'deck_media' not in st.session_state:
+    # Slide images referenced by cards in the deck: filename -> JPEG bytes
+    st.session_state.deck_media = {}
 
-def extract_pdf_text(pdf_file):
-    """Extract text from uploaded PDF file using pypdf"""
-    try:
-        # Read PDF from uploaded file
-        pdf_bytes = pdf_file.read()
-        pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
-        
-        # Extract metadata
-        metadata = {
-            "title": pdf_reader.metadata.title if pdf_reader.metadata and pdf_reader.metadata.title else "Unknown",
-            "author": pdf_reader.metadata.author if pdf_reader.metadata and pdf_reader.metadata.author else "Unknown",
-            "page_count": len(pdf_reader.pages)
-        }
-        
-        # Extract text from all pages
-        full_text = []
-        page_texts = []
-        
-        for page_num, page in enumerate(pdf_reader.pages):
-            text = page.extract_text()
-            page_texts.append({
-                "page": page_num + 1,
-                "text": text
-            })
-            full_text.append(text)
-        
-        return {
-            "full_text": "\n\n".join(full_text),
-            "pages": page_texts,
-            "metadata": metadata
-        }
-    except Exception as e:
-        st.error(f"Error extracting PDF text: {str(e)}")
-        return None
-
-def load_usmle_outline():
-    """Load USMLE Content Outline from PDF"""
-    try:
-        import os
-        from pypdf import PdfReader
-        import io
-        
-        # Try to load from same directory as script
-        script_dir = os.path.dirname(__file__)
-        usmle_path = os.path.join(script_dir, 'USMLE_Content_Outline.pdf')
-        
-        if os.path.exists(usmle_path):
-            with open(usmle_path, 'rb') as f:
-                pdf_reader = PdfReader(f)
-                outline_text = []
-                # Extract first 30 pages (covers most of the outline)
-                for page in pdf_reader.pages[:30]:
-                    outline_text.append(page.extract_text())
-                return "\n".join(outline_text)
-        else:
-            return None
-    except Exception as e:
-        return None
+def session_duplicate_index():
+    """Near-duplicate index over this session's deck, rebuilt if the deck changed outside it"""
+    index = st.session_state.get('duplicate_index')
+    if index is None or len(index) != len(st.session_state.card_store):
+        index = NearDuplicateIndex()
+        for record in st.session_state.card_store:
+            index.add(record.card)
+        st.session_state.duplicate_index = index
+    return index
 
-def generate_cards_with_claude(pdf_text, num_cards, api_key, model, lecture_title="", custom_guidance=""):
-    """Generate flashcards using GenAI"""
-    try:
-        import anthropic
-        
-        # Validate PDF text
-        if not pdf_text or len(pdf_text.strip()) < 100:
-            return None, "PDF text is too short or empty. Please upload a PDF with more content."
-        
-        # Validate and clean API key
-        api_key = api_key.strip()
-        if not api_key.startswith('sk-ant-'):
-            return None, "Invalid API key format. Key should start with 'sk-ant-'"
-        
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        # Load USMLE Content Outline
-        usmle_outline = load_usmle_outline()
-        
-        # Create the prompt for Claude
-        # Limit PDF text to ~15k chars to avoid token limits
-        pdf_content = pdf_text[:15000] if pdf_text else ""
-        usmle_content = usmle_outline[:10000] if usmle_outline else ""
-        
-        prompt = f"""You are an expert medical educator creating ANKI flashcards for USMLE STEP 1 preparation.
-
-Analyze the following medical lecture content and generate {num_cards} high-quality flashcard proposals.
-
-LECTURE CONTENT:
-{pdf_content}
-
-{"USMLE CONTENT OUTLINE (for categorization):" if usmle_outline else ""}
-{usmle_content}
-
-INSTRUCTIONS:
-1. Focus on high-yield concepts likely to appear on STEP 1
-2. Create a mix of card types:
-   - Basic cards (question → answer)
-   - Clinical vignette cards (case presentation → diagnosis/mechanism)
-   - Cloze deletion cards (fill-in-the-blank)
-3. Each card should test ONE specific concept
-4. Use clear, unambiguous questions
-5. Keep answers concise (1-3 sentences max)
-6. Include clinical context when possible
-7. For each card, determine:
-   - The primary organ system (e.g., "Nervous System & Special Senses", "Cardiovascular System", "Multisystem Processes")
-   - The USMLE category from the Content Outline (e.g., "Infectious disorders", "Neoplasms", "Degenerative disorders")
-
-# CONTENT SELECTION STRATEGY
-
-## PRIORITIZE (High-Yield):
-- Mechanisms of disease and pathophysiology
-- Classic presentations and buzzwords
-- First-line treatments and interventions
-- Diagnostic criteria and lab findings
-- Embryology and anatomy with clinical correlations
-- Pharmacology (mechanism, side effects, contraindications)
-- Epidemiology (most common, risk factors)
-- Comparisons and differentials ("X vs Y")
-- Content that appears in multiple contexts
-- Information emphasized by the lecturer (repeated, bolded, "important")
-
-## AVOID (Low-Yield):
-- Administrative information (dates, schedules, grading)
-- Overly detailed minutiae not clinically relevant
-- Purely historical information without clinical application
-- Instructor opinions without evidence basis
-
-{"## CUSTOM INSTRUCTIONS FROM USER:" + chr(10) + custom_guidance + chr(10) if custom_guidance else ""}OUTPUT FORMAT:
-Return ONLY a valid JSON array with this exact structure (no markdown, no explanations):
-
-[
-  {{
-    "type": "basic",
-    "front": "What is the question?",
-    "back": "This is the answer.",
-    "source": "{lecture_title if lecture_title else 'Medical Lecture'}",
-    "organ_system": "Nervous System & Special Senses",
-    "usmle_category": "Infectious disorders"
-  }},
-  {{
-    "type": "cloze",
-    "text": "The {{{{c1::answer}}}} is hidden in this sentence.",
-    "source": "{lecture_title if lecture_title else 'Medical Lecture'}",
-    "organ_system": "Nervous System & Special Senses",
-    "usmle_category": "Degenerative disorders"
-  }}
-]
-
-IMPORTANT: 
-- Return ONLY the JSON array, nothing else
-- Use double curly braces {{{{c1::text}}}} for cloze deletions
-- Ensure all JSON is valid (proper escaping of quotes, etc.)
-- Generate exactly {num_cards} cards
-- Always include organ_system and usmle_category fields
-- Use the exact organ system names from the USMLE Content Outline
-- Be specific with USMLE categories (not just "disorders" but the specific type)
-
-Generate the flashcards now:"""
-
-        # Call Claude API
-        # max_tokens scaled based on number of cards (~250 tokens per card + buffer)
-        max_tokens = max(4000, num_cards * 250 + 1000)
-        message = client.messages.create(
-            model=model,
-            max_tokens=max_tokens,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        # Extract response text
-        response_text = message.content[0].text
-        
-        # Try to parse JSON, handling potential markdown wrapping
-        response_text = response_text.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]  # Remove ```json
-        if response_text.startswith("```"):
-            response_text = response_text[3:]  # Remove ```
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]  # Remove trailing ```
-        response_text = response_text.strip()
-        
-        # Parse JSON
-        cards = json.loads(response_text)
-        
-        return cards, None
-        
-    except json.JSONDecodeError as e:
-        return None, "Failed to parse LLM's response as JSON. Please try again."
-    except ImportError:
-        return None, "Please install the Anthropic library: pip install anthropic"
-    except anthropic.AuthenticationError:
-        return None, "Authentication failed. Please check your API key is correct and has been copied fully."
-    except anthropic.PermissionDeniedError:
-        return None, "Permission denied. Make sure you have credits in your Anthropic account."
-    except anthropic.RateLimitError:
-        return None, "Rate limit exceeded. Please wait a moment and try again."
-    except Exception as e:
-        error_msg = str(e).lower()
-        if "invalid x-api-key" in error_msg or "authentication" in error_msg:
-            return None, "Invalid API key. Please double-check:\n1. Key starts with 'sk-ant-'\n2. No extra spaces\n3. Full key copied\n4. Key is active in console.anthropic.com"
-        return None, "Error calling Claude API. Please check your API key and try again."
-
-def create_medical_model():
-    """Create a custom ANKI model for medical flashcards with styling"""
-    import genanki
-    import random
-    
-    model_id = random.randrange(1 << 30, 1 << 31)
-    
-    return genanki.Model(
-        model_id,
-        'Medical Flashcard (STEP 1)',
-        fields=[
-            {'name': 'Front'},
-            {'name': 'Back'},
-            {'name': 'Source'},
-            {'name': 'OrganSystem'},
-            {'name': 'USMLECategory'},
-        ],
-        templates=[
-            {
-                'name': 'Card 1',
-                'qfmt': '''<div class="card-front">
-    <div class="question">{{Front}}</div>
-</div>''',
-                'afmt': '''<div class="card-back">
-    <div class="question">{{Front}}</div>
-    <hr>
-    <div class="answer">{{Back}}</div>
-    <div class="source">{{Source}}</div>
-    <div class="categories">
-        <span class="category">🧬 {{OrganSystem}}</span>
-        <span class="category">📋 {{USMLECategory}}</span>
-    </div>
-</div>''',
-            },
-        ],
-        css='''.card {
-    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
-    font-size: 18px;
-    text-align: left;
-    color: #12312B;
-    background-color: #ffffff;
-    padding: 20px;
-    line-height: 1.6;
-}
-
-.card-front, .card-back {
-    max-width: 600px;
-    margin: 0 auto;
-}
-
-.question {
-    font-size: 20px;
-    font-weight: 600;
-    color: #12312B;
-    margin-bottom: 15px;
-    padding: 15px;
-    background-color: #f7f7f7;
-    border-left: 4px solid #00693E;
-    border-radius: 4px;
-}
-
-.answer {
-    font-size: 18px;
-    color: #000000;
-    margin: 20px 0;
-    padding: 15px;
-    background-color: #f7f7f7;
-    border-radius: 4px;
-    border-left: 3px solid #267ABA;
-}
-
-.source {
-    font-size: 14px;
-    color: #707070;
-    font-style: italic;
-    margin-top: 15px;
-    padding-top: 10px;
-    border-top: 1px solid #e2e2e2;
-}
-
-.categories {
-    margin-top: 10px;
-    font-size: 13px;
-}
-
-.category {
-    display: inline-block;
-    background-color: #f7f7f7;
-    color: #00693E;
-    padding: 4px 8px;
-    border-radius: 4px;
-    margin-right: 8px;
-    font-weight: 500;
-    border: 1px solid #e2e2e2;
-}
-
-hr {
-    border: none;
-    border-top: 2px solid #e2e2e2;
-    margin: 15px 0;
-}
-
-.cloze {
-    font-weight: bold;
-    color: #00693E;
-}'''
-    )
+def add_card_to_deck(card, skip_near_duplicates=True):
+    """Append a generated card to the session deck, checking it against the cards already there
 
-def create_cloze_model():
-    """Create a custom ANKI cloze model for medical flashcards"""
-    import genanki
-    import random
-    
-    model_id = random.randrange(1 << 30, 1 << 31)
-    
-    return genanki.Model(
-        model_id,
-        'Medical Cloze (STEP 1)',
-        fields=[
-            {'name': 'Text'},
-            {'name': 'Source'},
-            {'name': 'OrganSystem'},
-            {'name': 'USMLECategory'},
-        ],
-        templates=[
-            {
-                'name': 'Cloze',
-                'qfmt': '''<div class="card-front">
-    <div class="question">{{cloze:Text}}</div>
-</div>''',
-                'afmt': '''<div class="card-back">
-    <div class="question">{{cloze:Text}}</div>
-    <div class="source">{{Source}}</div>
-    <div class="categories">
-        <span class="category">🧬 {{OrganSystem}}</span>
-        <span class="category">📋 {{USMLECategory}}</span>
-    </div>
-</div>''',
-            },
-        ],
-        css='''.card {
-    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
-    font-size: 18px;
-    text-align: left;
-    color: #12312B;
-    background-color: #ffffff;
-    padding: 20px;
-    line-height: 1.6;
-}
-
-.card-front, .card-back {
-    max-width: 600px;
-    margin: 0 auto;
-}
-
-.question {
-    font-size: 20px;
-    font-weight: 600;
-    color: #12312B;
-    margin-bottom: 15px;
-    padding: 15px;
-    background-color: #f7f7f7;
-    border-left: 4px solid #00693E;
-    border-radius: 4px;
-}
-
-.source {
-    font-size: 14px;
-    color: #707070;
-    font-style: italic;
-    margin-top: 15px;
-    padding-top: 10px;
-    border-top: 1px solid #e2e2e2;
-}
-
-.categories {
-    margin-top: 10px;
-    font-size: 13px;
-}
-
-.category {
-    display: inline-block;
-    background-color: #f7f7f7;
-    color: #00693E;
-    padding: 4px 8px;
-    border-radius: 4px;
-    margin-right: 8px;
-    font-weight: 500;
-    border: 1px solid #e2e2e2;
-}
-
-.cloze {
-    font-weight: bold;
-    color: #00693E;
-    background-color: #f7f7f7;
-    padding: 2px 6px;
-    border-radius: 3px;
-    border: 1px solid #e2e2e2;
-}''',
-        model_type=genanki.Model.CLOZE
-    )
+    Returns the near-duplicate match as (card, similarity), or None. With
+    skip_near_duplicates a matching card is not added; otherwise it is added
+    and the match is only reported.
+    """
+    match = session_duplicate_index().check_and_add(card, add_duplicates=not skip_near_duplicates)
+    if match is None or not skip_near_duplicates:
+        st.session_state.card_store.add(card)
+    return match
 
-def fix_anki_database(apkg_path):
-    """Fix ANKI database for compatibility with ANKI 2.1.28+"""
-    import sqlite3
-    import tempfile
-    import shutil
-    from pathlib import Path
-    
-    # Create temporary directory
-    temp_dir = tempfile.mkdtemp()
-    temp_zip = Path(temp_dir) / "temp.zip"
-    
-    try:
-        # Extract .apkg (which is a zip file)
-        shutil.copy(apkg_path, temp_zip)
-        shutil.unpack_archive(temp_zip, temp_dir)
-        
-        # Find and fix the collection database
-        db_path = Path(temp_dir) / "collection.anki2"
-        if not db_path.exists():
-            raise FileNotFoundError("collection.anki2 not found in package")
-        
-        # Connect to database and add missing fields
-        conn = sqlite3.connect(str(db_path))
-        cursor = conn.cursor()
-        
-        # Add graves table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS graves (
-                usn integer not null,
-                oid integer not null,
-                type integer not null
-            )
-        """)
-        
-        # Check if dconf table exists, if not create it
-        cursor.execute("""
-            SELECT name FROM sqlite_master 
-            WHERE type='table' AND name='dconf'
-        """)
-        dconf_exists = cursor.fetchone() is not None
-        
-        if dconf_exists:
-            # Fix dconf table - add usn field if missing
-            try:
-                cursor.execute("SELECT usn FROM dconf LIMIT 1")
-            except sqlite3.OperationalError:
-                cursor.execute("ALTER TABLE dconf ADD COLUMN usn INTEGER NOT NULL DEFAULT -1")
-        else:
-            # Create dconf table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS dconf (
-                    id integer primary key,
-                    conf text not null,
-                    usn integer not null default -1
-                )
-            """)
-        
-        # Fix decks in col table - ensure usn field exists in JSON
-        cursor.execute("SELECT decks FROM col")
-        decks_result = cursor.fetchone()
-        if decks_result:
-            decks_json = decks_result[0]
-            decks = json.loads(decks_json)
-            
-            for deck_id, deck_data in decks.items():
-                if 'usn' not in deck_data:
-                    deck_data['usn'] = -1
-            
-            cursor.execute("UPDATE col SET decks = ?", (json.dumps(decks),))
-        
-        # Fix models in col table - ensure usn field exists in JSON
-        cursor.execute("SELECT models FROM col")
-        models_result = cursor.fetchone()
-        if models_result:
-            models_json = models_result[0]
-            models = json.loads(models_json)
-            
-            for model_id, model_data in models.items():
-                if 'usn' not in model_data:
-                    model_data['usn'] = -1
-            
-            cursor.execute("UPDATE col SET models = ?", (json.dumps(models),))
-        
-        conn.commit()
-        conn.close()
-        
-        # Repackage
-        shutil.make_archive(str(temp_zip).replace('.zip', ''), 'zip', temp_dir, '.')
-        shutil.move(str(temp_zip), apkg_path)
-        
-    finally:
-        # Clean up
-        shutil.rmtree(temp_dir, ignore_errors=True)
+# Large exports are written here and served by Streamlit's static file route (server.enableStaticServing),
+# which streams them from disk instead of holding the package in the session
+EXPORT_DIR = Path(__file__).resolve().parent / "static" / "exports"
+# The static route answers 404 "File is too large" above this size (Streamlit's MAX_APP_STATIC_FILE_SIZE)
+STATIC_FILE_MAX_BYTES = 200 * 1024 * 1024
 
-def generate_apkg_file(selected_cards, deck_name):
-    """Generate .apkg file directly and return the file bytes"""
-    try:
-        import genanki
-        import random
-        import tempfile
-        from pathlib import Path
-        
-        # Create both models
-        basic_model = create_medical_model()
-        cloze_model = create_cloze_model()
-        
-        deck_id = random.randrange(1 << 30, 1 << 31)
-        deck = genanki.Deck(deck_id, deck_name)
-        
-        # Add cards with appropriate model
-        for card in selected_cards:
-            card_type = card.get('type', 'basic').lower()
-            
-            if card_type == 'cloze':
-                # Cloze card - use cloze model with Text field
-                note = genanki.Note(
-                    model=cloze_model,
-                    fields=[
-                        card.get('text', ''),
-                        card.get('source', ''),
-                        card.get('organ_system', ''),
-                        card.get('usmle_category', '')
-                    ]
-                )
-            else:
-                # Basic card - use basic model with Front/Back fields
-                note = genanki.Note(
-                    model=basic_model,
-                    fields=[
-                        card.get('front', ''),
-                        card.get('back', ''),
-                        card.get('source', ''),
-                        card.get('organ_system', ''),
-                        card.get('usmle_category', '')
-                    ]
-                )
-            
-            deck.add_note(note)
-        
-        # Generate package in temporary file
-        temp_dir = tempfile.mkdtemp()
-        temp_file = Path(temp_dir) / "deck.apkg"
-        
-        package = genanki.Package(deck)
-        package.write_to_file(str(temp_file))
-        
-        # Fix database for compatibility
-        fix_anki_database(str(temp_file))
-        
-        # Read file bytes
-        with open(temp_file, 'rb') as f:
-            apkg_bytes = f.read()
-        
-        # Clean up
-        import shutil
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        
-        return apkg_bytes, None
-        
-    except ImportError:
-        return None, "Please install genanki: pip install genanki"
-    except Exception as e:
-        return None, f"Error generating .apkg file: {str(e)}"
+def sweep_export_files(max_age_minutes):
+    """Delete exported packages older than max_age_minutes (abandoned or already downloaded)"""
+    if not EXPORT_DIR.is_dir():
+        return
+    cutoff = time.time() - max_age_minutes * 60
+    for export_dir in EXPORT_DIR.iterdir():
+        if export_dir.stat().st_mtime < cutoff:
+            shutil.rmtree(export_dir, ignore_errors=True)
+
+def export_filename(deck_name):
+    """Safe .apkg basename for a user-typed deck name: no path separators, dot segments or other punctuation"""
+    return (re.sub(r"[^\w.]+", "_", deck_name).strip("._") or "deck") + ".apkg"
+
+# Packages abandoned by sessions that never exported again are removed on any session's next run
+sweep_export_files(float(st.secrets.get("EXPORT_FILE_TTL_MINUTES", 30)))
+
+class SessionExportDir:
+    """This session's export directory, deleted when replaced or when the session's state is garbage-collected"""
+
+    def __init__(self):
+        self.path = EXPORT_DIR / secrets.token_urlsafe(16)
+        self.path.mkdir(parents=True)
+        # Streamlit drops a session's state when the session ends, which runs this
+        self.remove = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+def session_export_path(filename):
+    """Fresh path for this session's package under an unguessable directory, replacing its previous one"""
+    previous = st.session_state.get('export_dir')
+    if previous is not None:
+        previous.remove()
+    st.session_state.export_dir = SessionExportDir()
+    return st.session_state.export_dir.path / filename
+
+def session_changed_count(deck_name, selected_cards, manifest):
+    """How many selected cards are new or changed since the last export of this deck
+
+    Planning the export hashes every card, so the count is only recomputed
+    after the deck, the selection or an export manifest changes.
+    """
+    card_store = st.session_state.card_store
+    key = (card_store.version, card_store.selection_version, deck_name, st.session_state.export_manifest_version)
+    cached = st.session_state.get('export_changed_count')
+    if cached is None or cached[0] != key:
+        cached = (key, len(plan_export(selected_cards, manifest)))
+        st.session_state.export_changed_count = cached
+    return cached[1]
+
+def session_review_index():
+    """Review index over this session's deck, rebuilt only after the deck changes"""
+    cached = st.session_state.get('review_index')
+    if cached is None or cached[0] != st.session_state.card_store.version:
+        cached = (st.session_state.card_store.version, ReviewIndex(st.session_state.card_store))
+        st.session_state.review_index = cached
+    return cached[1]
 
 # ============================================================================
 # MAIN APP
@@ -899,7 +443,6 @@ st.markdown("""
 # Sidebar
 with st.sidebar:
     # Logo at top of sidebar
-    import os
     logo_path = os.path.join(os.path.dirname(__file__), 'logo.jpg')
     
     if os.path.exists(logo_path):
@@ -999,6 +542,12 @@ with st.sidebar:
         help="Choose which Claude model to use"
     )
     st.session_state.claude_model = model
+
+    rate_status = get_rate_limiter().status()
+    if rate_status["queue_depth"]:
+        st.caption(f"🚦 API queue: {rate_status['queue_depth']} waiting, ~{rate_status['wait_seconds']:.0f}s estimated wait")
+    else:
+        st.caption(f"🚦 API queue: empty (next request waits ~{rate_status['wait_seconds']:.0f}s)")
     
     # Number of cards to generate
     num_cards = st.slider(
@@ -1033,6 +582,29 @@ with st.sidebar:
         help="Name for your ANKI deck"
     )
 
+    with st.expander("📈 Cache & Performance"):
+        pdf_cache_stats = get_pdf_text_cache().stats()
+        st.caption(
+            f"PDF text cache: {pdf_cache_stats['hits']:,} hits / {pdf_cache_stats['misses']:,} misses "
+            f"({pdf_cache_stats['entries']} documents cached)"
+        )
+        st.caption(f"API clients kept warm: {get_client_pool().stats()['clients']}")
+        for row in get_token_telemetry().summary():
+            st.caption(
+                f"{row['model']} · {row['type']}: {row['avg_tokens_per_card']:.0f} output tokens/card "
+                f"over {row['cards']:,} cards (input estimate × {row['input_ratio']:.2f})"
+            )
+        usage_totals = get_usage_stats().snapshot()
+        st.caption(
+            f"Prompt cache: {usage_totals['cache_read_input_tokens']:,} tokens read / "
+            f"{usage_totals['cache_creation_input_tokens']:,} written over {usage_totals['requests']:,} requests"
+        )
+        if not system_prompt_cacheable():
+            st.caption(
+                f"Prompt caching is off: without USMLE_Content_Outline.pdf the instructions are under the "
+                f"{PROMPT_CACHE_MIN_TOKENS:,}-token minimum Anthropic caches"
+            )
+
 # Main content area with tabs
 tab1, tab2, tab3, tab4 = st.tabs(["📄 Upload PDF", "🔨 Generate Cards", "✅ Review & Select", "📥 Download ANKI File"])
 
@@ -1045,34 +617,132 @@ with tab1:
         type=['pdf'],
         help="Upload lecture slides, notes, or any medical education PDF"
     )
+    compact_text = st.checkbox(
+        "🧹 Strip repeated slide headers and footers",
+        value=True,
+        help="Remove lines repeated on most slides (course title, lecturer, copyright, slide numbers) "
+             "and tidy hyphenation and whitespace, so more lecture content fits in each request"
+    )
+    include_images = st.checkbox(
+        "🖼️ Add slide diagrams to cards",
+        value=False,
+        help="Extract the images in the PDF (skipping logos and graphics repeated on most slides), shrink them, "
+             "and show the matching slide's image on the back of each generated card"
+    )
     
     if uploaded_file is not None:
-        with st.spinner("Extracting text from PDF..."):
-            result = extract_pdf_text(uploaded_file)
-            
-            if result:
-                st.session_state.pdf_text = result['full_text']
-                st.session_state.pdf_metadata = result['metadata']
-                
-                st.success("✅ PDF extracted successfully!")
-                
-                # Display metadata
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Title", result['metadata']['title'])
-                with col2:
-                    st.metric("Author", result['metadata']['author'])
-                with col3:
-                    st.metric("Pages", result['metadata']['page_count'])
-                
-                # Show preview
-                with st.expander("📄 Preview Extracted Text"):
-                    st.text_area(
-                        "First 2000 characters:",
-                        value=result['full_text'][:2000] + "...",
-                        height=300,
-                        disabled=True
+        import hashlib
+
+        pdf_bytes = uploaded_file.getvalue()
+        cache_key = hashlib.sha256(pdf_bytes).hexdigest()
+        job = st.session_state.get('extraction_job')
+        extracted = st.session_state.get('extracted_pdf')
+        # The shared cache is only consulted for a new upload, so its hit/miss counts are extractions, not reruns
+        if extracted is not None and extracted[0] == cache_key:
+            result = extracted[1]
+        elif job is not None and job.cache_key == cache_key:
+            result = job.result if job.done else None
+        else:
+            result = get_pdf_text_cache().get(cache_key)
+
+        if result is None:
+            # Extract in the background so pages (and generation) become available while parsing continues
+            if job is None or job.cache_key != cache_key:
+                # Worker count and parallel threshold come from the PDF_EXTRACT_WORKERS / PDF_PARALLEL_MIN_PAGES secrets
+                job = PdfExtractionJob(pdf_bytes, cache_key, get_pdf_text_cache()).start()
+                st.session_state.extraction_job = job
+
+            if job.error:
+                st.error(f"Error extracting PDF text: {job.error}")
+            elif job.done:
+                result = job.result
+            else:
+                page_count = job.metadata['page_count'] if job.metadata else 0
+                st.progress(
+                    min(job.pages_done / page_count, 1.0) if page_count else 0.0,
+                    text=f"Extracting text from PDF... {job.pages_done}/{page_count} pages ({job.pages_per_second:.1f} pages/s)"
+                )
+                if job.prompt_ready():
+                    early_pages = job.pages_so_far()
+                    if compact_text:
+                        early_pages, _ = compact_pages(early_pages)
+                    st.session_state.pdf_text = "\n\n".join(page["text"] for page in early_pages)
+                    st.session_state.pdf_pages = early_pages
+                    st.session_state.pdf_metadata = job.metadata
+                    st.info("💡 Enough text has been extracted to start generating cards while the rest of the PDF is processed.")
+                    with st.expander("📄 Preview Extracted Text"):
+                        st.text_area(
+                            "First 2000 characters:",
+                            value=st.session_state.pdf_text[:2000] + "...",
+                            height=300,
+                            disabled=True
+                        )
+
+        if result:
+            st.session_state.extracted_pdf = (cache_key, result)
+
+        if result and compact_text:
+            # Compact once per upload rather than on every rerun
+            compacted = st.session_state.get('compacted_pdf')
+            if compacted is None or compacted[0] != cache_key:
+                compacted = (cache_key, compact_extraction(result))
+                st.session_state.compacted_pdf = compacted
+            result = compacted[1]
+
+        if result:
+            st.session_state.pdf_text = result['full_text']
+            st.session_state.pdf_pages = result['pages']
+            st.session_state.pdf_metadata = result['metadata']
+
+            st.success("✅ PDF extracted successfully!")
+            if job is not None and job.cache_key == cache_key and job.done:
+                st.caption(f"Extracted {job.pages_done} pages at {job.pages_per_second:.1f} pages/s")
+            if result.get('compaction', {}).get('chars_saved'):
+                compaction = result['compaction']
+                st.caption(
+                    f"🧹 Removed {compaction['lines_removed']:,} repeated header/footer lines: "
+                    f"{compaction['chars_saved']:,} characters (~{compaction['tokens_saved']:,} tokens) saved"
+                )
+
+            if include_images:
+                # Extract once per upload rather than on every rerun
+                slide_media = st.session_state.get('slide_media')
+                if slide_media is None or slide_media[0] != cache_key:
+                    try:
+                        with st.spinner("Extracting slide images..."):
+                            slide_media = (cache_key, extract_slide_media(pdf_bytes))
+                        st.session_state.slide_media = slide_media
+                    except ImportError:
+                        slide_media = None
+                        st.error("Please install Pillow: pip install Pillow")
+                if slide_media:
+                    media_stats = slide_media[1]['stats']
+                    st.caption(
+                        f"🖼️ {media_stats['images_kept']} slide images kept of {media_stats['images_found']} found "
+                        f"({media_stats['repeated_dropped']} repeated logos/graphics dropped), "
+                        f"shrunk from {media_stats['bytes_before'] / 1e6:.1f} MB to {media_stats['bytes_after'] / 1e6:.1f} MB "
+                        f"in {media_stats['seconds']:.1f}s"
                     )
+            else:
+                st.session_state.pop('slide_media', None)
+
+            # Display metadata
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Title", result['metadata']['title'])
+            with col2:
+                st.metric("Author", result['metadata']['author'])
+            with col3:
+                st.metric("Pages", result['metadata']['page_count'])
+
+            # Show preview
+            with st.expander("📄 Preview Extracted Text"):
+                st.text_area(
+                    "First 2000 characters:",
+                    value=result['full_text'][:2000] + "...",
+                    height=300,
+                    disabled=True
+                )
 
 # TAB 2: Generate Cards
 with tab2:
@@ -1085,14 +755,49 @@ with tab2:
         st.warning("⚠️ Please upload a PDF first in the 'Upload PDF' tab")
     else:
         # Show PDF content stats
+        lecture_preview = lecture_excerpt(
+            st.session_state.pdf_text,
+            st.session_state.get('claude_model', 'claude-sonnet-4-5-20250929')
+        )
         pdf_length = len(st.session_state.pdf_text)
         pdf_words = len(st.session_state.pdf_text.split())
         
         st.info(f"""
         📄 **PDF loaded:** {st.session_state.pdf_metadata.get('title', 'Unknown')}  
         📊 **Content:** {pdf_words:,} words, {pdf_length:,} characters  
-        💡 GenAI will analyze the first ~15,000 characters
+        💡 GenAI will analyze the first ~{len(lecture_preview):,} characters (~{LECTURE_TOKEN_BUDGET:,} token budget)
         """)
+
+        extraction_job = st.session_state.get('extraction_job')
+        if extraction_job is not None and not extraction_job.done:
+            st.caption(f"⏳ PDF extraction still running ({extraction_job.pages_done} pages so far) - generation uses the text extracted up to now")
+
+        # Long lectures can be covered in full by splitting them into concurrent per-chunk requests
+        chunked_mode = False
+        if len(lecture_preview) < pdf_length and st.session_state.pdf_pages:
+            chunked_mode = st.checkbox(
+                "📚 Cover the whole lecture (chunked generation)",
+                value=False,
+                help="Split the lecture into sections and generate cards from each one in parallel, "
+                     "spreading the requested number of cards across the whole document"
+            )
+        force_regenerate = st.checkbox(
+            "🔄 Force regenerate",
+            value=False,
+            help="Ignore previously generated cards for this exact lecture and settings and call the API again"
+        )
+        streaming_mode = False
+        if not chunked_mode:
+            streaming_mode = st.checkbox(
+                "⚡ Show cards as they are generated",
+                value=True,
+                help="Stream the response and add each card to your deck as soon as it is complete"
+            )
+        skip_near_duplicates = st.checkbox(
+            "🧹 Skip cards that repeat ones already in my deck",
+            value=True,
+            help="New cards that closely match a card you already have (same fact, reworded) are left out"
+        )
         
         # AI-powered generation section
         st.subheader("🤖 Generate with GenAI")
@@ -1112,10 +817,9 @@ with tab2:
         
         # Show what content will be sent to Claude
         with st.expander("🔍 Preview content that will be sent to the LLM"):
-            preview_length = min(15000, len(st.session_state.pdf_text))
             st.text_area(
-                f"First {preview_length:,} characters of your PDF:",
-                value=st.session_state.pdf_text[:preview_length],
+                f"First {len(lecture_preview):,} characters of your PDF:",
+                value=lecture_preview,
                 height=200,
                 disabled=True,
                 help="This is the content the LLM will use to generate flashcards"
@@ -1124,41 +828,206 @@ with tab2:
         with col2:
             if st.button("🚀 Generate with AI", type="primary", disabled='api_key' not in st.session_state or not st.session_state.api_key):
                 with st.spinner(f"The LLM is analyzing your PDF and generating {st.session_state.get('num_cards', 20)} flashcards..."):
-                    cards, error = generate_cards_with_claude(
-                        st.session_state.pdf_text,
-                        st.session_state.get('num_cards', 20),
-                        st.session_state.api_key,
-                        st.session_state.get('claude_model', 'claude-sonnet-4-5-20250929'),
-                        st.session_state.pdf_metadata.get('title', ''),
-                        st.session_state.get('custom_guidance', '')
-                    )
-                    
+                    generation_report = {}
+                    if chunked_mode:
+                        cards, error = generate_cards_chunked(
+                            st.session_state.pdf_pages,
+                            st.session_state.get('num_cards', 20),
+                            st.session_state.api_key,
+                            st.session_state.get('claude_model', 'claude-sonnet-4-5-20250929'),
+                            st.session_state.pdf_metadata.get('title', ''),
+                            st.session_state.get('custom_guidance', ''),
+                            max_concurrency=int(st.secrets.get("GENERATION_MAX_CONCURRENCY", GENERATION_MAX_CONCURRENCY)),
+                            report=generation_report,
+                            force_regenerate=force_regenerate,
+                            fill_missing=True
+                        )
+                    elif streaming_mode:
+                        cards = []
+                        near_duplicates = 0
+                        stream_status = st.empty()
+                        stream_started = time.monotonic()
+                        first_card_seconds = None
+                        for card in stream_cards_with_claude(
+                            st.session_state.pdf_text,
+                            st.session_state.get('num_cards', 20),
+                            st.session_state.api_key,
+                            st.session_state.get('claude_model', 'claude-sonnet-4-5-20250929'),
+                            st.session_state.pdf_metadata.get('title', ''),
+                            st.session_state.get('custom_guidance', ''),
+                            report=generation_report,
+                            force_regenerate=force_regenerate,
+                            fill_missing=True
+                        ):
+                            if first_card_seconds is None:
+                                first_card_seconds = time.monotonic() - stream_started
+                            # Add each card as it lands so it is kept even if the stream fails later
+                            if add_card_to_deck(card, skip_near_duplicates):
+                                near_duplicates += 1
+                            cards.append(card)
+                            stream_status.info(
+                                f"📝 {len(cards)} / {st.session_state.get('num_cards', 20)} cards received "
+                                f"(first card after {first_card_seconds:.1f}s): {card.get('front') or card.get('text', '')}"
+                            )
+                        stream_status.empty()
+                        error = generation_report.get("error")
+                        if error and cards:
+                            st.warning(f"⚠️ Generation stopped early; the {len(cards)} cards received so far were kept.")
+                    else:
+                        cards, error = generate_cards_with_claude(
+                            st.session_state.pdf_text,
+                            st.session_state.get('num_cards', 20),
+                            st.session_state.api_key,
+                            st.session_state.get('claude_model', 'claude-sonnet-4-5-20250929'),
+                            st.session_state.pdf_metadata.get('title', ''),
+                            st.session_state.get('custom_guidance', ''),
+                            report=generation_report,
+                            force_regenerate=force_regenerate,
+                            fill_missing=True
+                        )
+
+                    for chunk_error in generation_report.get("errors", []):
+                        st.warning(f"⚠️ {chunk_error}")
+                    if generation_report.get("dropped"):
+                        st.warning(
+                            f"⚠️ {generation_report['dropped']} card(s) were lost to a cut-off or malformed response; "
+                            f"{generation_report.get('recovered', 0)} replaced by a follow-up request."
+                        )
+
                     if error:
                         st.error(f"❌ {error}")
                     elif cards:
-                        # Add generated cards to flashcards list
-                        for card in cards:
-                            st.session_state.flashcards.append(card)
-                            st.session_state.card_selection[len(st.session_state.flashcards) - 1] = True
+                        # Add generated cards to flashcards list (streamed cards were added as they arrived)
+                        if not streaming_mode:
+                            near_duplicates = sum(
+                                1 for card in cards if add_card_to_deck(card, skip_near_duplicates)
+                            )
                         
                         st.success(f"✅ Successfully generated {len(cards)} flashcards! Go to 'Review & Select' tab to see them.")
+                        slide_media = st.session_state.get('slide_media')
+                        if slide_media:
+                            attached = attach_slide_images(cards, st.session_state.pdf_pages, slide_media[1])
+                            st.session_state.deck_media.update(
+                                (filename, slide_media[1]['files'][filename])
+                                for card in cards for filename in card.get('images', ())
+                            )
+                            st.caption(f"🖼️ Added a slide image to {attached} of {len(cards)} cards")
+                        if near_duplicates:
+                            if skip_near_duplicates:
+                                st.info(f"🧹 Skipped {near_duplicates} card(s) that repeat cards already in your deck")
+                            else:
+                                st.warning(f"⚠️ {near_duplicates} new card(s) closely match cards already in your deck")
+                        if generation_report.get("cache_hit"):
+                            st.caption("⚡ Served from the response cache - tick 'Force regenerate' for fresh cards")
+                        elif generation_report.get("usage"):
+                            usage = generation_report["usage"]
+                            st.caption(
+                                f"Tokens: {usage['input_tokens']:,} input, {usage['output_tokens']:,} output, "
+                                f"{usage['cache_read_input_tokens']:,} read from prompt cache, "
+                                f"{usage['cache_creation_input_tokens']:,} written to prompt cache"
+                            )
                         st.balloons()
 
+    # Batch generation for course coordinators: one card set per lecture
+    with st.expander("🗂️ Batch generation (multiple lectures)"):
+        st.markdown("Generate a separate card set for each lecture PDF in a block. Each set is saved as JSON.")
+        batch_files = st.file_uploader(
+            "Choose lecture PDFs",
+            type=['pdf'],
+            accept_multiple_files=True,
+            key="batch_files"
+        )
+        if st.button(
+            "🚀 Generate card sets",
+            disabled=not batch_files or not st.session_state.get('api_key'),
+            key="batch_generate"
+        ):
+            import asyncio
+
+            batch_progress = st.progress(0.0, text="Generating card sets...")
+            finished = []
+
+            def show_batch_progress(result):
+                finished.append(result)
+                batch_progress.progress(
+                    len(finished) / len(batch_files),
+                    text=f"Finished {len(finished)}/{len(batch_files)} lectures (latest: {result['lecture']})"
+                )
+
+            batch_results, batch_summary = asyncio.run(run_batch_generation(
+                [(batch_file.name, batch_file.getvalue()) for batch_file in batch_files],
+                st.session_state.get('num_cards', 20),
+                st.session_state.api_key,
+                st.session_state.get('claude_model', 'claude-sonnet-4-5-20250929'),
+                st.session_state.get('custom_guidance', ''),
+                extract_concurrency=int(st.secrets.get("BATCH_EXTRACT_CONCURRENCY", BATCH_EXTRACT_CONCURRENCY)),
+                api_concurrency=int(st.secrets.get("BATCH_API_CONCURRENCY", BATCH_API_CONCURRENCY)),
+                on_progress=show_batch_progress
+            ))
+            st.session_state.batch_results = batch_results
+            st.session_state.batch_summary = batch_summary
+
+        if st.session_state.get('batch_results'):
+            batch_summary = st.session_state.batch_summary
+            st.success(
+                f"✅ {batch_summary['lectures'] - batch_summary['failed']}/{batch_summary['lectures']} lectures, "
+                f"{batch_summary['cards']:,} cards in {batch_summary['wall_seconds']:.1f}s "
+                f"({batch_summary['lectures_per_minute']:.1f} lectures/min)"
+            )
+            st.dataframe(
+                [
+                    {
+                        "Lecture": result["lecture"],
+                        "Pages": result["pages"],
+                        "Cards": len(result["cards"]),
+                        "Extract (s)": round(result["extract_seconds"], 1),
+                        "Generate (s)": round(result["generate_seconds"], 1),
+                        "Total (s)": round(result["total_seconds"], 1),
+                        "Error": result["error"] or "",
+                    }
+                    for result in st.session_state.batch_results
+                ],
+                use_container_width=True
+            )
+            st.download_button(
+                label="📥 Download card sets (.zip)",
+                data=batch_results_zip(st.session_state.batch_results),
+                file_name="card_sets.zip",
+                mime="application/zip",
+                use_container_width=True
+            )
+
 # TAB 3: Review & Select
 with tab3:
     st.header("Review & Select Flashcards")
     
-    if not st.session_state.flashcards:
+    if not st.session_state.card_store:
         st.warning("⚠️ No flashcards generated yet. Please add cards in the 'Generate Cards' tab")
     else:
-        # Initialize selection state for new cards
-        for i in range(len(st.session_state.flashcards)):
-            if i not in st.session_state.card_selection:
-                st.session_state.card_selection[i] = True
+        card_store = st.session_state.card_store
+        review_index = session_review_index()
+        
+        # Filters, backed by the precomputed review index
+        facet_labels = {"type": "Card type", "organ_system": "Organ system", "usmle_category": "USMLE category"}
+        filter_cols = st.columns(len(REVIEW_FACETS))
+        active_filters = {}
+        for facet, filter_col in zip(REVIEW_FACETS, filter_cols):
+            options = review_index.options(facet)
+            counts = dict(options)
+            with filter_col:
+                active_filters[facet] = st.multiselect(
+                    facet_labels[facet],
+                    [value for value, _ in options],
+                    format_func=lambda value, counts=counts: f"{value or '(none)'} ({counts[value]})",
+                    key=f"review_filter_{facet}",
+                    on_change=lambda: st.session_state.update(review_page=1)
+                )
+        visible_ids = review_index.filter(active_filters)
+        filtered = any(active_filters.values())
         
         # Stats
-        total_cards = len(st.session_state.flashcards)
-        selected_cards = sum(1 for v in st.session_state.card_selection.values() if v)
+        total_cards = len(card_store)
+        selected_cards = card_store.selected_count
         
         col1, col2 = st.columns([2, 1])
         with col1:
@@ -1170,14 +1039,19 @@ with tab3:
             """, unsafe_allow_html=True)
         
         with col2:
-            if st.button("✅ Select All", use_container_width=True):
-                for i in range(len(st.session_state.flashcards)):
-                    st.session_state.card_selection[i] = True
+            # With filters active, the bulk buttons apply to the matching cards only
+            if st.button("✅ Select All", use_container_width=True,
+                         help="Select every card matching the filters" if filtered else None):
+                card_store.set_selected(visible_ids, True)
+                for card_id in visible_ids:
+                    st.session_state.pop(f"select_{card_id}", None)
                 st.rerun()
             
-            if st.button("❌ Deselect All", use_container_width=True):
-                for i in range(len(st.session_state.flashcards)):
-                    st.session_state.card_selection[i] = False
+            if st.button("❌ Deselect All", use_container_width=True,
+                         help="Deselect every card matching the filters" if filtered else None):
+                card_store.set_selected(visible_ids, False)
+                for card_id in visible_ids:
+                    st.session_state.pop(f"select_{card_id}", None)
                 st.rerun()
         
         # Instructions
@@ -1189,9 +1063,38 @@ with tab3:
         
         st.divider()
         
+        # Pagination: only the cards on the current page are rendered
+        page_col, size_col = st.columns([3, 1])
+        with size_col:
+            page_size = st.selectbox(
+                "Cards per page",
+                [10, 25, 50, 100],
+                index=1,
+                key="review_page_size",
+                on_change=lambda: st.session_state.update(review_page=1)
+            )
+        page_count = max(1, -(-len(visible_ids) // page_size))
+        with page_col:
+            page = st.number_input(
+                f"Page (of {page_count})",
+                min_value=1,
+                max_value=page_count,
+                value=min(st.session_state.get('review_page', 1), page_count),
+                step=1
+            )
+            st.session_state.review_page = page
+        page_ids = visible_ids[(page - 1) * page_size:page * page_size]
+        if filtered:
+            st.caption(f"{len(visible_ids):,} of {total_cards:,} cards match the filters")
+        if not visible_ids:
+            st.info("No cards match the selected filters.")
+        
         # Display cards
-        for idx, card in enumerate(st.session_state.flashcards):
-            is_selected = st.session_state.card_selection.get(idx, True)
+        for card_id in page_ids:
+            record = card_store.get(card_id)
+            card = record.card
+            display = review_index.display(card_id)
+            is_selected = record.selected
             
             card_class = "selected-card" if is_selected else ""
             
@@ -1202,31 +1105,30 @@ with tab3:
                     checked = st.checkbox(
                         "Select",
                         value=is_selected,
-                        key=f"select_{idx}",
+                        key=f"select_{card_id}",
                         label_visibility="collapsed"
                     )
-                    st.session_state.card_selection[idx] = checked
+                    if checked != is_selected:
+                        card_store.set_selected([card_id], checked)
                 
                 with col2:
                     st.markdown(f"""
                     <div class="card-container {card_class}">
-                        <div class="card-header">Card #{idx + 1} - {card.get('type', 'basic').upper()}</div>
+                        <div class="card-header">Card #{review_index.positions[card_id] + 1} - {card.get('type', 'basic').upper()}</div>
                     """, unsafe_allow_html=True)
                     
                     if card.get('type') == 'cloze':
-                        import re
-                        cloze_text = card.get('text', '')
-                        # Extract the cloze deletion content
-                        matches = re.findall(r'\{\{c\d+::(.*?)\}\}', cloze_text)
-                        # Show the text with the answer highlighted
-                        display_text = re.sub(r'\{\{c\d+::(.*?)\}\}', r'**[\1]**', cloze_text)
-                        st.markdown(f"**Text:** {display_text}")
-                        if matches:
-                            st.markdown(f"**Answer(s):** {', '.join(matches)}")
+                        st.markdown(f"**Text:** {display['text']}")
+                        if display['answers']:
+                            st.markdown(f"**Answer(s):** {', '.join(display['answers'])}")
                         st.markdown(f"*<small>In ANKI, the parts in [brackets] will be hidden</small>*", unsafe_allow_html=True)
                     else:
-                        st.markdown(f"**Front:** {card.get('front', '')}")
-                        st.markdown(f"**Back:** {card.get('back', '')}")
+                        st.markdown(f"**Front:** {display['front']}")
+                        st.markdown(f"**Back:** {display['back']}")
+                    
+                    for filename in card.get('images', ()):
+                        if filename in st.session_state.deck_media:
+                            st.image(st.session_state.deck_media[filename], width=320)
                     
                     if card.get('source'):
                         st.markdown(f"*Source: {card['source']}*")
@@ -1243,29 +1145,19 @@ with tab3:
                     st.markdown("</div>", unsafe_allow_html=True)
                 
                 # Delete button
-                if st.button("🗑️ Delete", key=f"delete_{idx}"):
-                    st.session_state.flashcards.pop(idx)
-                    # Rebuild selection dict
-                    new_selection = {}
-                    for i in range(len(st.session_state.flashcards)):
-                        if i < idx:
-                            new_selection[i] = st.session_state.card_selection.get(i, True)
-                        else:
-                            new_selection[i] = st.session_state.card_selection.get(i + 1, True)
-                    st.session_state.card_selection = new_selection
+                if st.button("🗑️ Delete", key=f"delete_{card_id}"):
+                    session_duplicate_index().remove(card_store.remove(card_id).card)
+                    st.session_state.pop(f"select_{card_id}", None)
                     st.rerun()
 
 # TAB 4: Download ANKI File
 with tab4:
     st.header("Download ANKI File")
     
-    if not st.session_state.flashcards:
+    if not st.session_state.card_store:
         st.warning("⚠️ No flashcards to export. Please generate cards first.")
     else:
-        selected_cards = [
-            card for idx, card in enumerate(st.session_state.flashcards)
-            if st.session_state.card_selection.get(idx, True)
-        ]
+        selected_cards = st.session_state.card_store.selected_cards()
         
         if not selected_cards:
             st.warning("⚠️ No cards selected. Please select at least one card in the 'Review & Select' tab.")
@@ -1290,16 +1182,85 @@ with tab4:
             5. Start studying!
             """)
 
+            # Notes already exported to this deck in this session, so a re-export only carries the changes
+            manifest = st.session_state.export_manifests.setdefault(deck_name, {})
+            export_manifest = None
+            if manifest:
+                changed = session_changed_count(deck_name, selected_cards, manifest)
+                only_changes = st.checkbox(
+                    f"🔁 Only include new or changed cards ({changed} of {len(selected_cards)})",
+                    value=True,
+                    help="Cards you already exported to this deck keep the same note IDs, so ANKI updates them instead of adding duplicates. Leave this on to download just the new and edited cards."
+                )
+                if only_changes:
+                    export_manifest = manifest
+                if st.button("Forget previous exports of this deck", key="reset_export_manifest"):
+                    manifest.clear()
+                    st.session_state.export_manifest_version += 1
+                    st.rerun()
+
             if st.button("🎯 Generate .apkg File", type="primary", use_container_width=True, key="generate_apkg"):
                 with st.spinner("Creating ANKI package..."):
                     # Generate filename
-                    filename = deck_name.replace(" ", "_").replace("-", "_") + ".apkg"
+                    filename = export_filename(deck_name)
 
                     # Generate .apkg file
-                    apkg_bytes, error = generate_apkg_file(selected_cards, deck_name)
+                    export_plan = plan_export(selected_cards, export_manifest)
+                    export_report = {}
+                    # Large decks go to disk and are served from there when static serving is on
+                    export_to_disk = (
+                        st.get_option("server.enableStaticServing")
+                        and len(export_plan) >= int(st.secrets.get("EXPORT_TO_DISK_MIN_CARDS", 1000))
+                    )
+                    if export_to_disk:
+                        apkg_path, error = export_apkg_file(
+                            selected_cards, deck_name, session_export_path(filename), export_manifest,
+                            media=st.session_state.deck_media, report=export_report, plan=export_plan
+                        )
+                        apkg_bytes = None
+                    else:
+                        apkg_bytes, error = generate_apkg_file(
+                            selected_cards, deck_name, export_manifest,
+                            media=st.session_state.deck_media, report=export_report, plan=export_plan
+                        )
+                    if not error and export_manifest is None:
+                        # A full export still counts as exported for the next incremental one
+                        manifest.update((guid, content_hash) for _, guid, content_hash in export_plan)
+                    if not error:
+                        st.session_state.export_manifest_version += 1
 
                     if error:
                         st.error(f"❌ {error}")
+                    elif export_to_disk and apkg_path.stat().st_size > STATIC_FILE_MAX_BYTES:
+                        st.success("✅ ANKI package created successfully!")
+                        st.warning(
+                            f"⚠️ This package is {apkg_path.stat().st_size / 1e6:.0f} MB, more than the "
+                            f"{STATIC_FILE_MAX_BYTES / 1e6:.0f} MB the direct download link can serve, so the whole "
+                            "package is loaded into the server's memory and sent through the download button below. "
+                            "For decks this large, the command line (`python -m anki_generator`) or exporting fewer "
+                            "cards at a time avoids that."
+                        )
+                        # st.download_button reads the file into memory: the cost the disk export otherwise avoids
+                        with open(apkg_path, "rb") as apkg_file:
+                            st.download_button(
+                                label=f"📥 Download {filename}",
+                                data=apkg_file,
+                                file_name=filename,
+                                mime="application/apkg",
+                                use_container_width=True
+                            )
+                    elif export_to_disk:
+                        st.success("✅ ANKI package created successfully!")
+
+                        # Streamed from disk by the static file route; removed on the next export, when the session ends or after the TTL
+                        download_url = "app/static/exports/" + quote(f"{apkg_path.parent.name}/{filename}")
+                        st.markdown(
+                            f'<a href="{download_url}" download="{html.escape(filename)}" '
+                            f'style="display: block; text-align: center; padding: 0.5rem; border-radius: 0.5rem; '
+                            f'background-color: #00693E; color: #ffffff; text-decoration: none;">'
+                            f'📥 Download {html.escape(filename)} ({apkg_path.stat().st_size / 1e6:.1f} MB)</a>',
+                            unsafe_allow_html=True
+                        )
                     elif apkg_bytes:
                         st.success("✅ ANKI package created successfully!")
 
@@ -1312,6 +1273,11 @@ with tab4:
                             use_container_width=True
                         )
 
+                    if not error:
+                        st.caption(
+                            f"📦 {export_report['notes']} notes and {export_report['images']} slide images, "
+                            f"{export_report['bytes'] / 1e6:.2f} MB, built in {export_report['seconds']:.2f}s"
+                        )
                         st.balloons()
 
                         # Instructions
@@ -1321,7 +1287,7 @@ with tab4:
                         2. Open ANKI on your computer
                         3. Go to File → Import
                         4. Select the downloaded `{filename}` file
-                        5. Your {len(selected_cards)} flashcards will be imported!
+                        5. Your {len(export_plan)} new or updated flashcards will be imported!
 
                         **Deck Name:** {deck_name}
                         """)
@@ -1336,3 +1302,9 @@ st.markdown("""
     <p><small>Contact <a href="mailto:thomas.thesen@dartmouth.edu" style="color: #00693E;">thomas.thesen@dartmouth.edu</a> with any questions</small></p>
 </div>
 """, unsafe_allow_html=True)
+
+# Keep polling while a background PDF extraction is running so its progress stays live
+_extraction_job = st.session_state.get('extraction_job')
+if _extraction_job is not None and not _extraction_job.done:
+    time.sleep(0.5)
+    st.rerun()
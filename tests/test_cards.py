@@ -0,0 +1,87 @@
+import json
+import types
+
+from anki_generator import generation
+from anki_generator.cards import CardStreamParser, salvage_cards
+
+CARDS = [
+    {"type": "basic", "front": "Which murmur does {mitral} regurgitation cause?", "back": "Holosystolic, at the apex"},
+    {"type": "cloze", "text": "Aortic stenosis causes a {{c1::crescendo-decrescendo}} murmur \"[systolic]\""},
+    {"type": "basic", "front": "First marker of hepatitis B?", "back": "HBsAg"},
+]
+RESPONSE = "```json\n" + json.dumps(CARDS, indent=2) + "\n```"
+
+
+def test_stream_parser_emits_each_card_when_complete():
+    parser = CardStreamParser()
+    cards = []
+    for i in range(0, len(RESPONSE), 7):
+        cards.extend(parser.feed(RESPONSE[i:i + 7]))
+    assert cards == CARDS
+    assert parser.closed
+    assert not parser.incomplete
+    assert parser.dropped == 0
+
+
+def test_stream_parser_counts_undecodable_objects():
+    parser = CardStreamParser()
+    cards = parser.feed('[{"type": "basic", "front": "Q", "back": "A"}, {"type": basic}]')
+    assert cards == [{"type": "basic", "front": "Q", "back": "A"}]
+    assert parser.dropped == 1
+    assert parser.closed
+
+
+def test_salvage_cards_keeps_complete_cards_of_a_cut_off_response():
+    cut = RESPONSE.index(CARDS[2]["back"])
+    cards, dropped = salvage_cards(RESPONSE[:cut])
+    assert cards == CARDS[:2]
+    assert dropped == 1
+
+
+def test_salvage_cards_without_an_array():
+    assert salvage_cards("I cannot help with that.") == ([], 0)
+
+
+class _FailingStream:
+    """Streams part of a response, then fails like a dropped connection"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        yield RESPONSE[:RESPONSE.index(CARDS[0]["back"])]
+        raise ConnectionError("connection reset")
+
+
+class _Stream(_FailingStream):
+    @property
+    def text_stream(self):
+        yield RESPONSE
+
+    def get_final_message(self):
+        usage = types.SimpleNamespace(
+            input_tokens=1000, output_tokens=300, cache_creation_input_tokens=0, cache_read_input_tokens=0
+        )
+        return types.SimpleNamespace(usage=usage)
+
+
+def test_stream_retry_after_partial_text_parses_the_new_response(monkeypatch):
+    streams = [_FailingStream(), _Stream()]
+    client = types.SimpleNamespace(messages=types.SimpleNamespace(stream=lambda **kwargs: streams.pop(0)))
+    monkeypatch.setattr(generation, "get_client_pool", lambda: types.SimpleNamespace(get=lambda api_key: client))
+    monkeypatch.setattr(generation, "get_response_cache", lambda: None)
+    monkeypatch.setattr(generation, "is_retryable_error", lambda error: True)
+    monkeypatch.setattr(generation, "retry_delay", lambda attempt, error=None: 0)
+
+    report = {}
+    cards = list(generation.stream_cards_with_claude(
+        "The cardiac cycle and its murmurs. " * 10, len(CARDS), "sk-ant-test", "claude-test", report=report
+    ))
+    assert "error" not in report
+    assert cards == CARDS
+    assert report["retries"] == 1
+    assert report["dropped"] == 0
@@ -0,0 +1,16 @@
+from anki_generator.compaction import compact_pages
+
+
+def _compact_text(*texts):
+    pages, _ = compact_pages([{"page": i + 1, "text": text} for i, text in enumerate(texts)])
+    return [page["text"] for page in pages]
+
+
+def test_hyphenated_compounds_keep_their_hyphen_across_line_breaks():
+    texts = _compact_text("Treat with a beta-\nblocker", "Hemophilia A is x-\nlinked recessive")
+    assert texts == ["Treat with a beta-blocker", "Hemophilia A is x-linked recessive"]
+
+
+def test_words_split_by_a_line_break_hyphen_are_rejoined():
+    texts = _compact_text("Dilated cardiomyo-\npathy follows myocarditis", "Cardiomyopathy causes heart failure")
+    assert texts[0] == "Dilated cardiomyopathy follows myocarditis"